@@ -0,0 +1,79 @@
+"""
+Synthetic `transaction` documents shaped like dbseed/transaction.agz
+({_id, merchantId, amount, createdAt}; amounts are multiples of 100 between
+10M and 1B rials), with configurable volume, merchant skew and date span.
+
+    python -m benchmarks.datagen --docs 1000000 --merchants 500 --skew 1.2 --days 730 --drop
+
+Loads into MONGO_URI / --db (default `zibal_bench`) with unordered bulk inserts.
+"""
+import argparse
+import os
+import random
+from datetime import datetime, timedelta, timezone
+from bson import ObjectId
+from pymongo import MongoClient
+
+DEFAULT_DB = 'zibal_bench'
+
+
+def merchant_weights(n_merchants: int, skew: float) -> list:
+    """Zipf-like weights: merchant k gets 1 / k**skew of the traffic (skew=0 is uniform)."""
+    return [1 / (k ** skew) for k in range(1, n_merchants + 1)]
+
+
+def generate(n_docs: int, n_merchants: int = 9, skew: float = 0.0, days: int = 430,
+             end: datetime | None = None, seed: int = 42):
+    rnd = random.Random(seed)
+    end = end or datetime(2024, 8, 14, tzinfo=timezone.utc)
+    start = end - timedelta(days=days)
+    span = int((end - start).total_seconds())
+    merchants = [ObjectId.from_datetime(start + timedelta(seconds=i)) for i in range(n_merchants)]
+    weights = merchant_weights(n_merchants, skew)
+
+    for m in rnd.choices(merchants, weights=weights, k=n_docs):
+        yield {
+            'merchantId': m,
+            'amount': rnd.randint(100_000, 10_000_000) * 100,
+            'createdAt': start + timedelta(seconds=rnd.randrange(span)),
+        }
+
+
+def load(coll, docs, batch_size: int = 10_000) -> int:
+    n, batch = 0, []
+    for d in docs:
+        batch.append(d)
+        if len(batch) >= batch_size:
+            coll.insert_many(batch, ordered=False)
+            n += len(batch)
+            batch = []
+    if batch:
+        coll.insert_many(batch, ordered=False)
+        n += len(batch)
+    return n
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument('--docs', type=int, default=100_000)
+    p.add_argument('--merchants', type=int, default=9)
+    p.add_argument('--skew', type=float, default=0.0, help='Zipf exponent of merchant popularity')
+    p.add_argument('--days', type=int, default=430, help='date span ending 2024-08-14')
+    p.add_argument('--seed', type=int, default=42)
+    p.add_argument('--batch-size', type=int, default=10_000)
+    p.add_argument('--uri', default=os.getenv('MONGO_URI', 'mongodb://localhost:27017'))
+    p.add_argument('--db', default=DEFAULT_DB)
+    p.add_argument('--drop', action='store_true', help='drop the collection first')
+    args = p.parse_args()
+
+    coll = MongoClient(args.uri)[args.db]['transaction']
+    if args.drop:
+        coll.drop()
+    n = load(coll, generate(args.docs, args.merchants, args.skew, args.days, seed=args.seed), args.batch_size)
+    coll.create_index([('merchantId', 1), ('createdAt', 1)], name='merchant_createdAt')
+    coll.create_index([('createdAt', 1)], name='createdAt')
+    print(f"inserted {n} docs into {args.db}.transaction")
+
+
+if __name__ == '__main__':
+    main()
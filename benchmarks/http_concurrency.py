@@ -0,0 +1,79 @@
+"""
+Compare req/s of the sync (WSGI) and async (ASGI) report endpoints under
+concurrent load.
+
+Start both servers against the same database, e.g.
+
+    python manage.py runserver 0.0.0.0:8000                      # WSGI
+    uvicorn config.asgi:application --port 8001 --workers 1      # ASGI
+
+then run
+
+    python -m benchmarks.http_concurrency \
+        --wsgi http://localhost:8000/api/v1/transactions/report/ \
+        --asgi http://localhost:8001/api/v1/transactions/report/async/ \
+        --concurrency 64 --requests 512 --mode daily
+
+Each request asks for a distinct `from` date so the in-process report cache
+can't answer it and every call really runs an aggregation.
+"""
+import argparse
+import json
+import statistics
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from time import perf_counter
+
+
+def _call(url: str, body: dict) -> float:
+    req = urllib.request.Request(url, data=json.dumps(body).encode(), method='GET',
+                                 headers={'Content-Type': 'application/json'})
+    t = perf_counter()
+    with urllib.request.urlopen(req, timeout=300) as resp:
+        resp.read()
+        if resp.status != 200:
+            raise RuntimeError(f"{url} -> {resp.status}")
+    return perf_counter() - t
+
+
+def run(url: str, concurrency: int, n: int, mode: str, merchant_id: str | None) -> dict:
+    bodies = []
+    for i in range(n):
+        body = {'type': 'count', 'mode': mode, 'from': (date(2020, 1, 1) + timedelta(days=i)).isoformat()}
+        if merchant_id:
+            body['merchantId'] = merchant_id
+        bodies.append(body)
+
+    t = perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        latencies = list(pool.map(lambda b: _call(url, b), bodies))
+    elapsed = perf_counter() - t
+    latencies.sort()
+    return {
+        'url': url,
+        'requests': n,
+        'concurrency': concurrency,
+        'req_per_s': round(n / elapsed, 2),
+        'p50_ms': round(statistics.median(latencies) * 1000, 1),
+        'p95_ms': round(latencies[int(len(latencies) * 0.95) - 1] * 1000, 1),
+    }
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument('--wsgi', required=True)
+    p.add_argument('--asgi', required=True)
+    p.add_argument('--concurrency', type=int, default=32)
+    p.add_argument('--requests', type=int, default=256)
+    p.add_argument('--mode', choices=['daily', 'weekly', 'monthly'], default='daily')
+    p.add_argument('--merchant-id')
+    args = p.parse_args()
+
+    results = [run(url, args.concurrency, args.requests, args.mode, args.merchant_id)
+               for url in (args.wsgi, args.asgi)]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
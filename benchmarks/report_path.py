@@ -0,0 +1,176 @@
+"""
+Time each stage of the transaction report path per mode and scope:
+aggregation, rollup, label sort, serialization, and the two report views
+end to end. Results are written as JSON and can be compared with a
+baseline run.
+
+    python -m benchmarks.datagen --docs 1000000 --merchants 500 --skew 1.2 --drop
+    python -m benchmarks.report_path --out bench.json
+    python -m benchmarks.report_path --baseline bench.json --threshold 0.15
+
+The second run exits non-zero if any stage's median got slower than the
+baseline by more than the threshold (relative).
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from contextlib import ExitStack
+from datetime import datetime, timezone
+from time import perf_counter
+from unittest import mock
+
+from benchmarks.datagen import DEFAULT_DB
+
+MODES = ['daily', 'weekly', 'monthly']
+
+
+def _setup_django(db_name: str):
+    os.environ['MONGO_DB_NAME'] = db_name
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+    import django
+    django.setup()
+
+
+def _time(fn, repeat: int) -> dict:
+    runs = []
+    for _ in range(repeat):
+        t = perf_counter()
+        fn()
+        runs.append((perf_counter() - t) * 1000)
+    return {'median_ms': round(statistics.median(runs), 3), 'min_ms': round(min(runs), 3), 'runs': repeat}
+
+
+def _no_redis():
+    """
+    Patches that keep Redis out of the timed view runs: access sampling and
+    rebuild requests become no-ops and the report cache runs process-local
+    (without a Redis server each call would otherwise wait out its socket timeout).
+    """
+    from redis.exceptions import RedisError
+
+    def unavailable():
+        raise RedisError("disabled for benchmarking")
+
+    stack = ExitStack()
+    stack.enter_context(mock.patch('transaction.views.record_access'))
+    stack.enter_context(mock.patch('transaction.views.request_rebuild'))
+    stack.enter_context(mock.patch('transaction.report_cache.get_redis', unavailable))
+    return stack
+
+
+def run(repeat: int) -> dict:
+    from rest_framework.renderers import JSONRenderer
+    from rest_framework.test import APIRequestFactory
+    from transaction.helpers import (aggregate_daily_both, aggregate_buckets_both, rollup_both,
+                                     label_to_gregorian_date)
+    from transaction.report_cache import report_cache
+    from transaction.summary import MODES as ALL_MODES, get_collections, build_full
+    from transaction.views import TransactionReportView, TransactionReportCachedView
+
+    tx, out, state = get_collections()
+    top = next(tx.aggregate([
+        {'$group': {'_id': '$merchantId', 'n': {'$sum': 1}}}, {'$sort': {'n': -1}}, {'$limit': 1},
+    ]), None)
+    scopes = {'global': None}
+    if top:
+        scopes['top_merchant'] = top['_id']
+
+    factory = APIRequestFactory()
+    live_view = TransactionReportView.as_view()
+    cached_view = TransactionReportCachedView.as_view()
+    renderer = JSONRenderer()
+
+    results = {}
+    for scope, merchant in scopes.items():
+        build_full(tx, out, state, merchant, ALL_MODES)
+        match = {'merchantId': merchant} if merchant else {}
+        daily = aggregate_daily_both(tx, match)
+
+        for mode in MODES:
+            prefix = f"{scope}/{mode}"
+            rows = rollup_both(daily, mode)
+            labels = [r['label_jalali'] for r in rows][::-1]
+            data = [{'key': r['label_jalali'], 'value': r['count']} for r in rows]
+            body = {'type': 'count', 'mode': mode}
+            if merchant:
+                body['merchantId'] = str(merchant)
+
+            def live():
+                report_cache.invalidate(everything=True)
+                resp = live_view(factory.generic('GET', '/', json.dumps(body), content_type='application/json'))
+                resp.render()
+
+            def cached():
+                resp = cached_view(factory.generic('GET', '/', json.dumps(body), content_type='application/json'))
+                resp.render()
+
+            stages = {
+                'aggregate_daily': lambda: aggregate_daily_both(tx, match),
+                'rollup': lambda: rollup_both(daily, mode),
+                'sort_labels': lambda: sorted(labels, key=lambda lbl: label_to_gregorian_date(mode, lbl)),
+                'serialize': lambda: renderer.render(data),
+                'view_live': live,
+                'view_cached': cached,
+            }
+            if mode != 'daily':
+                stages['aggregate_buckets'] = lambda: aggregate_buckets_both(tx, match, mode)
+            with _no_redis():
+                for stage, fn in stages.items():
+                    results[f"{prefix}/{stage}"] = _time(fn, repeat)
+            results[f"{prefix}/rows"] = len(rows)
+
+    return {'docs': tx.estimated_document_count(), 'results': results}
+
+
+def compare(current: dict, baseline: dict, threshold: float) -> list:
+    """Stages whose median exceeds the baseline median by more than `threshold` (relative)."""
+    regressions = []
+    for key, cur in current['results'].items():
+        base = baseline['results'].get(key)
+        if not isinstance(cur, dict) or not isinstance(base, dict):
+            continue
+        if base['median_ms'] > 0 and cur['median_ms'] > base['median_ms'] * (1 + threshold):
+            regressions.append((key, base['median_ms'], cur['median_ms']))
+    return regressions
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument('--db', default=DEFAULT_DB)
+    p.add_argument('--repeat', type=int, default=5)
+    p.add_argument('--out', help='write results JSON here')
+    p.add_argument('--baseline', help='results JSON of an earlier run to compare against')
+    p.add_argument('--threshold', type=float, default=0.2)
+    args = p.parse_args()
+
+    _setup_django(args.db)
+    report = run(args.repeat)
+    try:
+        rev = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        rev = None
+    report['meta'] = {'db': args.db, 'repeat': args.repeat, 'git': rev,
+                      'at': datetime.now(timezone.utc).isoformat(timespec='seconds')}
+
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            f.write(text)
+    else:
+        print(text)
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.threshold)
+        for key, base, cur in regressions:
+            print(f"REGRESSION {key}: {base:.3f}ms -> {cur:.3f}ms", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""
+Per-task preparation cost of the notify worker (template render, Faker
+params, provider and recipient; no send, no Mongo) right after a process
+start, with and without the worker warm-up.
+
+    python -m benchmarks.worker_startup --tasks 200
+
+Each variant runs in a fresh interpreter, like a restarted worker process:
+
+- per-call: the old behaviour, a new Faker per call, a new provider per
+  task, templates.json loaded by the first task;
+- warm: `notify.tasks.warm_up` (what worker_process_init runs) first, then
+  the same tasks.
+
+Reported: warm-up time, first-task latency and the median/p95 of the rest.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from time import perf_counter
+
+CHANNELS = ['sms', 'email', 'telegram']
+VARIANTS = ['per-call', 'warm']
+
+
+def _child(variant: str, n: int) -> dict:
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+    import django
+    django.setup()
+    from faker import Faker
+    from notify import tasks
+
+    warm_up_ms = None
+    if variant == 'per-call':
+        tasks._faker = lambda locale='en_US': Faker(locale)
+        tasks._provider = lambda channel: tasks._PROVIDERS[channel]()
+    else:
+        t = perf_counter()
+        tasks.warm_up()
+        warm_up_ms = (perf_counter() - t) * 1000
+
+    runs = []
+    for i in range(n):
+        t = perf_counter()
+        tasks._prepare(f'merchant-{i}', CHANNELS[i % len(CHANNELS)], 'fa' if i % 2 else 'en')
+        runs.append((perf_counter() - t) * 1000)
+    rest = sorted(runs[1:])
+    return {
+        'variant': variant,
+        'warm_up_ms': round(warm_up_ms, 2) if warm_up_ms is not None else None,
+        'first_task_ms': round(runs[0], 2),
+        'task_p50_ms': round(statistics.median(rest), 3),
+        'task_p95_ms': round(rest[int(len(rest) * 0.95) - 1], 3),
+    }
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument('--tasks', type=int, default=200)
+    p.add_argument('--child', choices=VARIANTS, help=argparse.SUPPRESS)
+    args = p.parse_args()
+
+    if args.child:
+        print(json.dumps(_child(args.child, args.tasks)))
+        return
+
+    for variant in VARIANTS:
+        out = subprocess.run([sys.executable, '-m', 'benchmarks.worker_startup', '--child', variant,
+                              '--tasks', str(args.tasks)], capture_output=True, text=True, check=True).stdout
+        print(json.dumps(json.loads(out.splitlines()[-1]), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+# the async report views are only mounted here, where requests share one event loop per process
+os.environ.setdefault('DJANGO_ROOT_URLCONF', 'config.asgi_urls')
 
 application = get_asgi_application()
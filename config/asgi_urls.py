@@ -0,0 +1,13 @@
+"""
+URL configuration of the ASGI entry point (config.asgi): everything in
+config.urls plus the async report views, which need the long-lived event
+loop of an ASGI server.
+"""
+from django.urls import path, include
+from transaction.urls import async_urlpatterns
+from .urls import urlpatterns as sync_urlpatterns
+
+urlpatterns = [
+    path("api/v1/", include(async_urlpatterns)),
+    *sync_urlpatterns,
+]
@@ -55,7 +55,7 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
-ROOT_URLCONF = 'config.urls'
+ROOT_URLCONF = getenv("DJANGO_ROOT_URLCONF", "config.urls")  # config.asgi sets config.asgi_urls
 
 TEMPLATES = [
     {
@@ -124,7 +124,56 @@ REST_FRAMEWORK = {
 # Mongo Configs
 MONGO_URI = getenv('MONGO_URI')
 MONGO_DB_NAME = getenv('MONGO_DB_NAME', 'zibal_db')
-SUMMARY_TTL_SECONDS = getenv("SUMMARY_TTL_SECONDS", 86400)
+# Connection pool and timeouts (per process; None keeps the driver default)
+MONGO_MAX_POOL_SIZE = int(getenv("MONGO_MAX_POOL_SIZE", 50))
+MONGO_MIN_POOL_SIZE = int(getenv("MONGO_MIN_POOL_SIZE", 0))
+MONGO_MAX_IDLE_TIME_MS = int(getenv("MONGO_MAX_IDLE_TIME_MS", 60000))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", 5000))
+MONGO_CONNECT_TIMEOUT_MS = int(getenv("MONGO_CONNECT_TIMEOUT_MS", 5000))
+MONGO_SOCKET_TIMEOUT_MS = int(getenv("MONGO_SOCKET_TIMEOUT_MS")) if getenv("MONGO_SOCKET_TIMEOUT_MS") else None
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", 2000))
+# Named read routes: heavy report reads may go to secondaries; everything else stays on the primary
+MONGO_READ_ROUTES = {
+    "default": "primary",
+    "reports": getenv("MONGO_REPORTS_READ_PREFERENCE", "secondaryPreferred"),
+}
+MONGO_MAX_STALENESS_SECONDS = int(getenv("MONGO_MAX_STALENESS_SECONDS", -1))
+# Summaries count as fresh for SUMMARY_TTL_SECONDS after their last refresh; older ones are still
+# served (flagged stale) while a rebuild runs. The TTL index only deletes them after the retention.
+SUMMARY_TTL_SECONDS = int(getenv("SUMMARY_TTL_SECONDS", 86400))
+SUMMARY_RETENTION_SECONDS = int(getenv("SUMMARY_RETENTION_SECONDS", 7 * 86400))
+SUMMARY_REBUILD_LOCK_SECONDS = int(getenv("SUMMARY_REBUILD_LOCK_SECONDS", 900))
+SUMMARY_REBUILD_TIME_LIMIT = int(getenv("SUMMARY_REBUILD_TIME_LIMIT", 600))
+# Beat job keeping the most requested scopes fresh, within a budget of Mongo work per run
+SUMMARY_PREWARM_TOP_N = int(getenv("SUMMARY_PREWARM_TOP_N", 50))
+SUMMARY_PREWARM_BUDGET_SECONDS = int(getenv("SUMMARY_PREWARM_BUDGET_SECONDS", 120))
+SUMMARY_PREWARM_INTERVAL_SECONDS = int(getenv("SUMMARY_PREWARM_INTERVAL_SECONDS", 600))
+# Sampled per-scope request counters (Redis) that rank scopes for pre-warming
+REPORT_ACCESS_SAMPLE_RATE = float(getenv("REPORT_ACCESS_SAMPLE_RATE", 0.1))
+REPORT_ACCESS_WINDOW_HOURS = int(getenv("REPORT_ACCESS_WINDOW_HOURS", 24))
+SUMMARY_BULK_BATCH_SIZE = int(getenv("SUMMARY_BULK_BATCH_SIZE", 1000))
+SUMMARY_STREAM_BATCH_SIZE = int(getenv("SUMMARY_STREAM_BATCH_SIZE", 500))
+SUMMARY_STREAM_MAX_WAIT_MS = int(getenv("SUMMARY_STREAM_MAX_WAIT_MS", 1000))
+# The watcher rewrites a scope's compact series docs at most this often (they lag its buckets by up to this)
+SUMMARY_SERIES_REFRESH_SECONDS = float(getenv("SUMMARY_SERIES_REFRESH_SECONDS", 10))
+
+# In-process report cache (per API worker)
+REPORT_CACHE_MAX_ENTRIES = int(getenv("REPORT_CACHE_MAX_ENTRIES", 256))
+REPORT_CACHE_TTL_SECONDS = int(getenv("REPORT_CACHE_TTL_SECONDS", 60))
+# How often a worker re-reads the Redis invalidation counters of a scope it serves from cache
+REPORT_CACHE_INVALIDATION_CHECK_MS = int(getenv("REPORT_CACHE_INVALIDATION_CHECK_MS", 500))
+REPORT_BATCH_MAX_MERCHANTS = int(getenv("REPORT_BATCH_MAX_MERCHANTS", 50))
+REPORT_STREAM_CHUNK_ITEMS = int(getenv("REPORT_STREAM_CHUNK_ITEMS", 500))
+# Admission control for raw report aggregations: concurrent slots per process (and optionally
+# across processes via Redis), how long a request may wait for one, and maxTimeMS per mode
+REPORT_MAX_CONCURRENT_AGGREGATIONS = int(getenv("REPORT_MAX_CONCURRENT_AGGREGATIONS", 4))
+REPORT_GLOBAL_MAX_AGGREGATIONS = int(getenv("REPORT_GLOBAL_MAX_AGGREGATIONS", 0))  # 0: per-process only
+REPORT_ADMISSION_WAIT_MS = int(getenv("REPORT_ADMISSION_WAIT_MS", 250))
+REPORT_MAX_TIME_MS = {
+    "daily": int(getenv("REPORT_MAX_TIME_MS_DAILY", 10000)),
+    "weekly": int(getenv("REPORT_MAX_TIME_MS_WEEKLY", 15000)),
+    "monthly": int(getenv("REPORT_MAX_TIME_MS_MONTHLY", 20000)),
+}
 
 #  Celery Configs
 CELERY_BROKER_URL = getenv("CELERY_BROKER_URL", "redis://localhost:6379/0")
@@ -135,10 +184,40 @@ CELERY_TASK_DEFAULT_QUEUE = "notifications"
 CELERY_BROKER_TRANSPORT_OPTIONS = {"visibility_timeout": 3600}
 CELERY_TASK_TIME_LIMIT = 20
 CELERY_TASK_SOFT_TIME_LIMIT = 5
+CELERY_BEAT_SCHEDULE = {
+    "prewarm-hot-summaries": {
+        "task": "transaction.prewarm_hot_summaries",
+        "schedule": SUMMARY_PREWARM_INTERVAL_SECONDS,
+        "options": {"queue": "summaries", "expires": SUMMARY_PREWARM_INTERVAL_SECONDS},
+    },
+}
+
+# Redis for app-level coordination (dedup locks); defaults to the broker
+REDIS_URL = getenv("REDIS_URL", CELERY_BROKER_URL)
+REDIS_SOCKET_TIMEOUT = float(getenv("REDIS_SOCKET_TIMEOUT", 0.5))
 
 
 # Notifications configs
 NOTIFY_DEFAULT_LANG = "fa"
 NOTIFY_MAX_RETRIES = 3
 NOTIFY_BACKOFF_BASE = 2
-NOTIFY_BACKOFF_JITTER_SEC = 2
\ No newline at end of file
+NOTIFY_BACKOFF_JITTER_SEC = 2
+# Bulk endpoint: entries per request, entries per chunk task, and a chunk's soft time limit
+NOTIFY_BULK_MAX_ENTRIES = int(getenv("NOTIFY_BULK_MAX_ENTRIES", 10000))
+NOTIFY_BULK_CHUNK_SIZE = int(getenv("NOTIFY_BULK_CHUNK_SIZE", 200))
+NOTIFY_BULK_SOFT_TIME_LIMIT = int(getenv("NOTIFY_BULK_SOFT_TIME_LIMIT", 120))
+# "sequential": a chunk task sends one entry at a time; "asyncio": all entries of a chunk are in flight
+# at once on an event loop, bounded per provider, so slow gateways don't idle the worker process
+NOTIFY_BULK_MODE = getenv("NOTIFY_BULK_MODE", "asyncio")
+NOTIFY_PROVIDER_CONCURRENCY = {
+    "local_sms": int(getenv("NOTIFY_SMS_CONCURRENCY", 100)),
+    "local_email": int(getenv("NOTIFY_EMAIL_CONCURRENCY", 20)),
+    "local_telegram": int(getenv("NOTIFY_TELEGRAM_CONCURRENCY", 30)),
+}
+NOTIFY_SEND_TIMEOUT_SEC = float(getenv("NOTIFY_SEND_TIMEOUT_SEC", 30))
+# notification_logs writes are buffered per worker process and flushed with insert_many once
+# NOTIFY_LOG_BUFFER_SIZE records are queued or the oldest is NOTIFY_LOG_FLUSH_INTERVAL_SEC old
+NOTIFY_LOG_BUFFER_SIZE = int(getenv("NOTIFY_LOG_BUFFER_SIZE", 100))
+NOTIFY_LOG_FLUSH_INTERVAL_SEC = float(getenv("NOTIFY_LOG_FLUSH_INTERVAL_SEC", 2))
+# TTL of notification_logs records (ttl_timestamp index, applied by ensure_mongo_indexes)
+NOTIFY_LOG_RETENTION_SECONDS = int(getenv("NOTIFY_LOG_RETENTION_SECONDS", 30 * 24 * 3600))
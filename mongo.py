@@ -1,13 +1,95 @@
+import asyncio
+import os
+import weakref
 from django.conf import settings
-from pymongo import MongoClient
+from pymongo import MongoClient, AsyncMongoClient
+from pymongo.read_preferences import Primary, PrimaryPreferred, Secondary, SecondaryPreferred, Nearest
 
 _client = None
+_pid = None
+_dbs = {}
+# Async clients are bound to the event loop they run on: under ASGI that is one
+# loop (and one pool) per process. The async views are only mounted under ASGI
+# (config.asgi_urls), since WSGI async_to_sync calls each get a new loop.
+_async_clients = weakref.WeakKeyDictionary()
 
-def get_db():
-    global _client
-    if _client is None:
-        _client = MongoClient(settings.MONGO_URI, tz_aware=True)
-    return _client[settings.MONGO_DB_NAME]
+_READ_PREFERENCES = {
+    'primary': Primary,
+    'primaryPreferred': PrimaryPreferred,
+    'secondary': Secondary,
+    'secondaryPreferred': SecondaryPreferred,
+    'nearest': Nearest,
+}
 
-def get_collection(name: str):
-    return get_db()[name]
\ No newline at end of file
+
+def _reset_after_fork():
+    # The child must not reuse the parent's sockets; drop the references
+    # (without closing, which would disturb the parent) and reconnect lazily.
+    global _client, _pid
+    _client, _pid = None, None
+    _dbs.clear()
+    _async_clients.clear()
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def client_options() -> dict:
+    """MongoClient kwargs from settings (pool sizing and timeouts)."""
+    opts = {
+        'tz_aware': True,
+        'maxPoolSize': settings.MONGO_MAX_POOL_SIZE,
+        'minPoolSize': settings.MONGO_MIN_POOL_SIZE,
+        'maxIdleTimeMS': settings.MONGO_MAX_IDLE_TIME_MS,
+        'serverSelectionTimeoutMS': settings.MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        'connectTimeoutMS': settings.MONGO_CONNECT_TIMEOUT_MS,
+        'socketTimeoutMS': settings.MONGO_SOCKET_TIMEOUT_MS,
+        'waitQueueTimeoutMS': settings.MONGO_WAIT_QUEUE_TIMEOUT_MS,
+    }
+    return {k: v for k, v in opts.items() if v is not None}
+
+
+def read_preference(route: str):
+    """Read preference of a named route from MONGO_READ_ROUTES (unknown routes read from the primary)."""
+    mode = settings.MONGO_READ_ROUTES.get(route, 'primary')
+    if mode == 'primary':
+        return Primary()
+    staleness = int(getattr(settings, 'MONGO_MAX_STALENESS_SECONDS', -1))
+    return _READ_PREFERENCES[mode](max_staleness=staleness)
+
+
+def get_client():
+    """Process-wide client, re-created lazily in a forked child (e.g. Celery prefork workers)."""
+    global _client, _pid
+    if _client is None or _pid != os.getpid():
+        _dbs.clear()
+        _client = MongoClient(settings.MONGO_URI, **client_options())
+        _pid = os.getpid()
+    return _client
+
+
+def get_db(route: str = 'default'):
+    client = get_client()
+    db = _dbs.get(route)
+    if db is None:
+        db = _dbs[route] = client.get_database(settings.MONGO_DB_NAME, read_preference=read_preference(route))
+    return db
+
+
+def get_collection(name: str, route: str = 'default'):
+    """
+    Collection handle on a named read route. Writes always go to the primary;
+    the route only decides where reads (finds, aggregations) are sent.
+    """
+    return get_db(route)[name]
+
+
+def get_async_db(route: str = 'default'):
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = _async_clients[loop] = AsyncMongoClient(settings.MONGO_URI, **client_options())
+    return client.get_database(settings.MONGO_DB_NAME, read_preference=read_preference(route))
+
+
+def get_async_collection(name: str, route: str = 'default'):
+    return get_async_db(route)[name]
@@ -0,0 +1,44 @@
+import uuid
+from django.utils import timezone
+from mongo import get_collection
+
+
+def create_batch(total: int, chunks: int) -> str:
+    """Tracking doc of one bulk request in `notification_batches`; returns its id."""
+    batch_id = uuid.uuid4().hex
+    get_collection("notification_batches").insert_one({
+        "_id": batch_id,
+        "total": total,
+        "chunks": chunks,
+        "sent": 0,
+        "failed": 0,
+        "createdAt": timezone.now(),
+    })
+    return batch_id
+
+
+def record_progress(batch_id: str | None, sent: int = 0, failed: int = 0):
+    """Count entries that reached a final outcome (no-op outside a batch)."""
+    if not batch_id or not (sent or failed):
+        return
+    get_collection("notification_batches").update_one(
+        {"_id": batch_id},
+        {"$inc": {"sent": sent, "failed": failed}, "$set": {"updatedAt": timezone.now()}},
+    )
+
+
+def get_batch(batch_id: str) -> dict | None:
+    doc = get_collection("notification_batches").find_one({"_id": batch_id})
+    if doc is None:
+        return None
+    pending = doc["total"] - doc["sent"] - doc["failed"]
+    return {
+        "batch_id": doc["_id"],
+        "status": "done" if pending <= 0 else "running",
+        "total": doc["total"],
+        "sent": doc["sent"],
+        "failed": doc["failed"],
+        "pending": max(pending, 0),
+        "createdAt": doc["createdAt"],
+        "updatedAt": doc.get("updatedAt"),
+    }
@@ -0,0 +1,23 @@
+from django.conf import settings
+
+INDEXES = [
+    # attempt lookups by Celery task id: nothing in the notify path reads logs back, but this is how a
+    # task's attempts are looked up when investigating a delivery, and without it that is a full scan
+    {'collection': 'notification_logs', 'keys': [('task_id', 1)], 'name': 'task_id'},
+    # attempt logs are audit data, not history: expire them instead of growing forever
+    {'collection': 'notification_logs', 'keys': [('timestamp', 1)], 'name': 'ttl_timestamp',
+     'options': {'expireAfterSeconds': int(getattr(settings, 'NOTIFY_LOG_RETENTION_SECONDS', 30 * 24 * 3600))}},
+]
+
+
+def plan_checks(db):
+    """
+    (name, explain command) pairs for the reads and updates the notify path
+    runs: bulk batch progress and status, both by `_id`. Log writes are plain
+    inserts, so there is nothing to explain for them.
+    """
+    return [
+        ('bulk batch progress', {'update': 'notification_batches',
+                                 'updates': [{'q': {'_id': 'plan-check'}, 'u': {'$inc': {'sent': 0, 'failed': 0}}}]}),
+        ('bulk batch status', {'find': 'notification_batches', 'filter': {'_id': 'plan-check'}, 'limit': 1}),
+    ]
@@ -1,11 +1,107 @@
+import atexit
+import os
+import threading
+from time import monotonic, sleep
+from celery.signals import worker_process_shutdown, worker_shutdown
+from django.conf import settings
 from django.utils import timezone
+from pymongo.errors import BulkWriteError, PyMongoError
 from mongo import get_collection
 
+
+class LogBuffer:
+    """
+    In-process buffer of `notification_logs` records, written with one
+    `insert_many` once it holds `max_records` or its oldest record is
+    `max_delay` seconds old (checked on every add and by a background
+    flusher thread). A failed write keeps the records (up to `max_records` x
+    10) for the next flush; they keep the `_id` insert_many gave them, so a
+    record the failed write did store comes back as a duplicate key error and
+    is dropped instead of written twice. Records still buffered when a process dies hard
+    are lost; set NOTIFY_LOG_BUFFER_SIZE=1 to write every record immediately.
+    """
+
+    def __init__(self, max_records: int, max_delay: float):
+        self.max_records = max_records
+        self.max_delay = max_delay
+        self._lock = threading.Lock()
+        self._records = []
+        self._oldest = None
+        self._flusher = None
+        self._pid = None
+
+    def _reset(self):
+        # forked child: drop the parent's records and flusher, start fresh on first add
+        self._lock = threading.Lock()
+        self._records, self._oldest = [], None
+        self._flusher, self._pid = None, None
+
+    def _ensure_flusher(self):
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._flusher = threading.Thread(target=self._run, name="notification-log-flusher", daemon=True)
+            self._flusher.start()
+
+    def _run(self):
+        while True:
+            sleep(self.max_delay)
+            try:
+                self.flush(only_due=True)
+            except PyMongoError:
+                pass
+
+    def add(self, record: dict):
+        with self._lock:
+            self._ensure_flusher()
+            self._records.append(record)
+            if self._oldest is None:
+                self._oldest = monotonic()
+            due = len(self._records) >= self.max_records or monotonic() - self._oldest >= self.max_delay
+        if due:
+            try:
+                self.flush()
+            except PyMongoError:
+                pass  # kept for the flusher; logging must not fail the send
+
+    def flush(self, only_due: bool = False) -> int:
+        with self._lock:
+            if not self._records or (only_due and monotonic() - self._oldest < self.max_delay):
+                return 0
+            records, self._records, self._oldest = self._records, [], None
+        try:
+            get_collection("notification_logs").insert_many(records, ordered=False)
+        except PyMongoError as exc:
+            if isinstance(exc, BulkWriteError):
+                # 11000: written by an earlier attempt; anything not in writeErrors was written now
+                failed = {e["index"] for e in exc.details.get("writeErrors", []) if e.get("code") != 11000}
+                records = [r for i, r in enumerate(records) if i in failed]
+                if not records:
+                    return exc.details.get("nInserted", 0)
+            with self._lock:
+                self._records = (records + self._records)[-self.max_records * 10:]
+                self._oldest = monotonic()
+            raise
+        return len(records)
+
+
+log_buffer = LogBuffer(
+    max_records=int(getattr(settings, "NOTIFY_LOG_BUFFER_SIZE", 100)),
+    max_delay=float(getattr(settings, "NOTIFY_LOG_FLUSH_INTERVAL_SEC", 2)),
+)
+os.register_at_fork(after_in_child=log_buffer._reset)
+atexit.register(log_buffer.flush)
+
+
+@worker_process_shutdown.connect
+@worker_shutdown.connect
+def _flush_logs(**kwargs):
+    log_buffer.flush()
+
+
 def log_attempt(*, task_id: str, channel: str, merchant_id: str, lang: str,
                 attempt_no: int, status: str, provider: str,
                 request_meta: dict, response_meta: dict | None, error: str | None):
-    coll = get_collection("notification_logs")
-    coll.insert_one({
+    log_buffer.add({
         "task_id": task_id,
         "channel": channel,
         "merchantId": merchant_id,
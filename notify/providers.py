@@ -1,3 +1,4 @@
+import asyncio
 import random
 from dataclasses import dataclass
 from time import sleep
@@ -5,17 +6,26 @@ from time import sleep
 class TransientError(Exception): pass
 class PermanentError(Exception): pass
 
+# Every provider has a blocking `send` and an awaitable `asend` with the same
+# arguments and outcome; `asend` lets one process keep many sends in flight.
+
 @dataclass
 class SMSProvider:
     name: str = "local_sms"
     fail_rate: float = 0.15   # Note that the fail rate is extremely high for this channel 
-    def send(self,text: str, phone: str):
-        sleep(12.11) # Observe the timeout situation
+    latency: float = 12.11
+    def _result(self, phone: str):
         if not phone or not phone.startswith("+"):
             raise PermanentError("invalid phone")
         if random.random() < self.fail_rate:  
             raise TransientError("SMS gateway timeout")
         return {"provider_id": f"sms-{random.randint(100000, 999999)}"}
+    def send(self,text: str, phone: str):
+        sleep(self.latency) # Observe the timeout situation
+        return self._result(phone)
+    async def asend(self, text: str, phone: str):
+        await asyncio.sleep(self.latency)
+        return self._result(phone)
 
 @dataclass
 class EmailProvider:
@@ -27,6 +37,8 @@ class EmailProvider:
         if random.random() < self.fail_rate:
             raise TransientError("SMTP temp fail")
         return {"provider_id": f"mail-{random.randint(100000, 999999)}"}
+    async def asend(self, subject: str, text: str, html: str, email: str):
+        return self.send(subject=subject, text=text, html=html, email=email)
 
 @dataclass
 class TelegramProvider:
@@ -38,3 +50,12 @@ class TelegramProvider:
         if random.random() < self.fail_rate:
             raise TransientError("Telegram 5xx")
         return {"provider_id": f"tg-{random.randint(100000, 999999)}"}
+    async def asend(self, text: str, chat_id: int):
+        return self.send(text=text, chat_id=chat_id)
+
+
+async def asend(provider, **kwargs):
+    """provider.asend(), or its blocking send() in a thread for providers without one."""
+    if hasattr(provider, "asend"):
+        return await provider.asend(**kwargs)
+    return await asyncio.to_thread(provider.send, **kwargs)
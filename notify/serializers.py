@@ -1,3 +1,4 @@
+from django.conf import settings
 from rest_framework import serializers
 from bson import ObjectId
 
@@ -21,3 +22,14 @@ class ResetPasswordRequestTelegramSerializer(serializers.Serializer):
     merchantId = ObjectIdField(required=True)
     chat_id = serializers.FloatField(required=True)
     lang = serializers.ChoiceField(choices=["fa", "en"], required=False, default=None)
+
+
+class ResetPasswordBulkEntrySerializer(serializers.Serializer):
+    merchantId = ObjectIdField(required=True)
+    channel = serializers.ChoiceField(choices=["sms", "email", "telegram"])
+    lang = serializers.ChoiceField(choices=["fa", "en"], required=False, default=None)
+    chat_id = serializers.IntegerField(required=False)  # telegram only; a random chat is used when omitted
+
+
+class ResetPasswordBulkRequestSerializer(serializers.Serializer):
+    entries = ResetPasswordBulkEntrySerializer(many=True, allow_empty=False, max_length=settings.NOTIFY_BULK_MAX_ENTRIES)
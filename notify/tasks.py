@@ -1,16 +1,48 @@
+import asyncio
+import os
 import random
+import threading
 from celery import shared_task
 from celery.exceptions import SoftTimeLimitExceeded
+from celery.signals import worker_init, worker_process_init
 from django.conf import settings
 from faker import Faker
 
-from .template_registry import get_block
-from .providers import SMSProvider, EmailProvider, TelegramProvider, TransientError, PermanentError
+from .template_registry import get_block, get_templates
+from .providers import SMSProvider, EmailProvider, TelegramProvider, TransientError, PermanentError, asend
 from .logging import log_attempt
+from .batches import record_progress
+
+_local = threading.local()
+_PROVIDERS = {"sms": SMSProvider, "email": EmailProvider, "telegram": TelegramProvider}
+_provider_instances = {}
+_provider_slots = {}
+
 
 # Helpers
+def _faker(locale: str = "en_US") -> Faker:
+    """
+    This thread's Faker for `locale`. Building one loads every locale
+    provider, so each thread builds it once; its own random state (reseeded
+    in forked children) keeps threads and worker processes from sharing one
+    generator.
+    """
+    fakers = _local.__dict__.setdefault("fakers", {})
+    fk = fakers.get(locale)
+    if fk is None:
+        fk = fakers[locale] = Faker(locale)
+        fk.seed_instance()
+    return fk
+
+def _reseed_fakers():
+    # a forked child inherits the forking thread's Fakers, random state included
+    for fk in _local.__dict__.get("fakers", {}).values():
+        fk.seed_instance()
+
+os.register_at_fork(after_in_child=_reseed_fakers)
+
 def _faker_params(merchant_id: str) -> dict:
-    fk = Faker('fa_IR')
+    fk = _faker('fa_IR')
     return {
         "merchantId": merchant_id,
         "name": fk.name(),
@@ -36,22 +68,30 @@ def _render(template_key: str, channel: str, lang: str, params: dict):
     raise PermanentError("unsupported channel")
 
 def _provider(channel: str):
-    return {"sms": SMSProvider, "email": EmailProvider, "telegram": TelegramProvider}[channel]()
+    # providers hold only their configuration, so one instance per process serves every task and thread
+    prov = _provider_instances.get(channel)
+    if prov is None:
+        prov = _provider_instances.setdefault(channel, _PROVIDERS[channel]())
+    return prov
+
+def _provider_slot(name: str) -> threading.BoundedSemaphore:
+    # single sends in flight per provider across this process's threads (threads pool)
+    slot = _provider_slots.get(name)
+    if slot is None:
+        limit = int(getattr(settings, "NOTIFY_PROVIDER_CONCURRENCY", {}).get(name, 10))
+        slot = _provider_slots.setdefault(name, threading.BoundedSemaphore(limit))
+    return slot
 
 def _recipient(channel: str):
-    fk = Faker()
+    fk = _faker()
     if channel == "sms":      return {"phone": "+989" + str(random.randint(100000000, 999999999))}
     if channel == "email":    return {"email": fk.email()}
     if channel == "telegram": return {"chat_id": random.randint(10_000_000, 99_999_999)}
     return {}
 
 
-@shared_task(bind=True, name="notify.send_reset_password", queue="notifications")
-def send_reset_password_task(self, merchant_id: str, channel: str, lang: str, *args, **kwargs):
-    # We compute attempt_no from how many logs exist for this task_id
-    from mongo import get_collection
-    task_id = self.request.id
-
+def _prepare(merchant_id: str, channel: str, lang: str, chat_id=None):
+    """Render the message and pick provider + recipient: (provider, payload, send kwargs, request meta)."""
     template_key = "reset_password"
     params = _faker_params(merchant_id)
     payload = _render(template_key, channel, lang, params)
@@ -62,35 +102,76 @@ def send_reset_password_task(self, merchant_id: str, channel: str, lang: str, *a
     req_meta = {"provider": prov.name}
     if channel == "sms":
         req_meta.update({"to": rcpt["phone"], "size": len(payload["text"])})
+        send_kwargs = {"text": payload["text"], "phone": rcpt["phone"]}
     elif channel == "telegram":
         req_meta.update({"chat_id": rcpt["chat_id"], "size": len(payload["text"])})
+        send_kwargs = {"text": payload["text"], "chat_id": chat_id if chat_id is not None else rcpt["chat_id"]}
     else:
         req_meta.update({"to": rcpt["email"], "subject_len": len(payload["subject"]), "text_len": len(payload["text"])})
+        send_kwargs = {"subject": payload["subject"], "text": payload["text"], "html": payload["html"], "email": rcpt["email"]}
+    return prov, payload, send_kwargs, req_meta
+
+
+@worker_init.connect
+@worker_process_init.connect
+def warm_up(**kwargs):
+    """
+    Load templates.json and build the providers and Fakers before the first
+    task, so a (re)started worker process doesn't pay for them on it. Runs in
+    every prefork child and in the worker's main process (where solo and
+    threads pools run their tasks).
+    """
+    get_templates()
+    for channel in _PROVIDERS:
+        _provider(channel)
+    _faker('fa_IR')
+    _faker()
+
+
+def _backoff(retries: int) -> int:
+    base = int(getattr(settings, "NOTIFY_BACKOFF_BASE", 2))
+    jitter = int(getattr(settings, "NOTIFY_BACKOFF_JITTER_SEC", 3))
+    return (base ** retries) + random.randint(0, max(0, jitter))
+
+
+async def _send(prov, send_kwargs: dict):
+    """One provider send bounded by NOTIFY_SEND_TIMEOUT_SEC; a timeout is a TransientError."""
+    timeout = float(getattr(settings, "NOTIFY_SEND_TIMEOUT_SEC", 30))
+    try:
+        return await asyncio.wait_for(asend(prov, **send_kwargs), timeout)
+    except asyncio.TimeoutError:
+        raise TransientError("provider timeout")
+
+
+# the send itself is bounded by NOTIFY_SEND_TIMEOUT_SEC; the limits only leave room around it
+@shared_task(bind=True, name="notify.send_reset_password", queue="notifications",
+             soft_time_limit=settings.NOTIFY_SEND_TIMEOUT_SEC + 5, time_limit=settings.NOTIFY_SEND_TIMEOUT_SEC + 20)
+def send_reset_password_task(self, merchant_id: str, channel: str, lang: str, *args, **kwargs):
+    task_id = self.request.id
+    batch_id = kwargs.get("batch_id")
+
+    prov, payload, send_kwargs, req_meta = _prepare(merchant_id, channel, lang, kwargs.get("chat_id"))
 
-    # what attempt number is this?
-    logs = get_collection("notification_logs")
-    attempt_no = logs.count_documents({"task_id": task_id}) + 1
+    # what attempt number is this? (retries keep the task id; logs are written in batches)
+    attempt_no = self.request.retries + 1
 
     try:
         print("".join(["\n", "#"*10,"\n",'\t'*2,payload["text"],"\n","#"*10,"\n"]))
-        if channel == "sms":
-            resp = prov.send(text=payload["text"], phone=rcpt["phone"])
-        elif channel == "email":
-            resp = prov.send(subject=payload["subject"], text=payload["text"], html=payload["html"], email=rcpt["email"])
-        else:
-            chat_id = kwargs.get("chat_id", rcpt["chat_id"])
-            resp = prov.send(text=payload["text"], chat_id=chat_id)
+        with _provider_slot(prov.name):
+            resp = asyncio.run(_send(prov, send_kwargs))
 
         # success
         log_attempt(task_id=task_id, channel=channel, merchant_id=merchant_id, lang=lang,
                     attempt_no=attempt_no, status="sent", provider=prov.name,
                     request_meta=req_meta, response_meta=resp, error=None)
+        record_progress(batch_id, sent=1)
         return {"ok": True, "provider_id": resp.get("provider_id")}
 
     except PermanentError as e:
         log_attempt(task_id=task_id, channel=channel, merchant_id=merchant_id, lang=lang,
                     attempt_no=attempt_no, status="failed", provider=prov.name,
                     request_meta=req_meta, response_meta=None, error=str(e))
+        record_progress(batch_id, failed=1)
         return {"ok": False, "error": str(e)}
 
     except (TransientError, SoftTimeLimitExceeded) as e:
@@ -100,12 +181,104 @@ def send_reset_password_task(self, merchant_id: str, channel: str, lang: str, *a
 
         # retry policy
         max_retries = int(getattr(settings, "NOTIFY_MAX_RETRIES", 3))
-        base = int(getattr(settings, "NOTIFY_BACKOFF_BASE", 2))
-        jitter = int(getattr(settings, "NOTIFY_BACKOFF_JITTER_SEC", 3))
 
         if self.request.retries + 1 >= max_retries:
             # final failure; no more retries
+            record_progress(batch_id, failed=1)
             return {"ok": False, "error": str(e)}
 
-        countdown = (base ** self.request.retries) + random.randint(0, max(0, jitter))
-        raise self.retry(exc=e, countdown=countdown)
+        raise self.retry(exc=e, countdown=_backoff(self.request.retries))
+
+
+async def _send_concurrently(prepared: dict, outcomes: dict):
+    """
+    Send every prepared entry at once on one event loop, with at most
+    NOTIFY_PROVIDER_CONCURRENCY[provider] sends in flight per provider and
+    NOTIFY_SEND_TIMEOUT_SEC per send. Fills outcomes[i] as sends finish.
+    """
+    limits = getattr(settings, "NOTIFY_PROVIDER_CONCURRENCY", {})
+    sems = {}
+
+    async def one(i, prov, send_kwargs):
+        sem = sems.setdefault(prov.name, asyncio.Semaphore(int(limits.get(prov.name, 10))))
+        async with sem:
+            try:
+                outcomes[i] = ("sent", await _send(prov, send_kwargs))
+            except PermanentError as e:
+                outcomes[i] = ("permanent", e)
+            except TransientError as e:
+                outcomes[i] = ("transient", e)
+
+    await asyncio.gather(*(one(i, prov, send_kwargs) for i, (prov, _, send_kwargs, _) in prepared.items()))
+
+
+def _send_sequentially(prepared: dict, outcomes: dict):
+    for i, (prov, _, send_kwargs, _) in prepared.items():
+        try:
+            outcomes[i] = ("sent", prov.send(**send_kwargs))
+        except PermanentError as e:
+            outcomes[i] = ("permanent", e)
+        except TransientError as e:
+            outcomes[i] = ("transient", e)
+
+
+@shared_task(bind=True, name="notify.send_reset_password_batch", queue="notifications",
+             soft_time_limit=settings.NOTIFY_BULK_SOFT_TIME_LIMIT, time_limit=settings.NOTIFY_BULK_SOFT_TIME_LIMIT + 15)
+def send_reset_password_batch_task(self, batch_id: str, entries: list, attempt: int = 1):
+    """
+    One chunk of a bulk reset-password request, sent in a single task: one
+    after another, or all concurrently on an event loop when
+    NOTIFY_BULK_MODE is "asyncio". Each entry is logged under
+    `<task id>:<index>`. Entries that fail transiently are queued together as
+    the chunk's next attempt after the usual backoff, up to
+    NOTIFY_MAX_RETRIES attempts; if the chunk runs out of time, the unsent
+    rest is queued as a new chunk of the same attempt.
+    """
+    failed = 0
+    prepared = {}  # index -> (provider, payload, send kwargs, request meta)
+    for i, entry in enumerate(entries):
+        try:
+            prepared[i] = _prepare(entry["merchant_id"], entry["channel"], entry["lang"], entry.get("chat_id"))
+        except PermanentError as e:
+            # nothing was sent, but the entry is final: record it like any other failed attempt
+            log_attempt(task_id=f"{self.request.id}:{i}", channel=entry["channel"], merchant_id=entry["merchant_id"],
+                        lang=entry["lang"], attempt_no=attempt, status="failed", provider=_provider(entry["channel"]).name,
+                        request_meta={}, response_meta=None, error=str(e))
+            failed += 1
+
+    outcomes = {}  # index -> (kind, provider response or error)
+    try:
+        if getattr(settings, "NOTIFY_BULK_MODE", "asyncio") == "asyncio":
+            asyncio.run(_send_concurrently(prepared, outcomes))
+        else:
+            _send_sequentially(prepared, outcomes)
+    except SoftTimeLimitExceeded:
+        rest = [entries[i] for i in prepared if i not in outcomes]
+        if rest:
+            send_reset_password_batch_task.apply_async(args=[batch_id, rest], kwargs={"attempt": attempt})
+
+    sent = 0
+    retry = []
+    for i, (kind, result) in sorted(outcomes.items()):
+        entry = entries[i]
+        prov, _, _, req_meta = prepared[i]
+        ok = kind == "sent"
+        log_attempt(task_id=f"{self.request.id}:{i}", channel=entry["channel"], merchant_id=entry["merchant_id"],
+                    lang=entry["lang"], attempt_no=attempt, status="sent" if ok else "failed", provider=prov.name,
+                    request_meta=req_meta, response_meta=result if ok else None, error=None if ok else str(result))
+        if ok:
+            sent += 1
+        elif kind == "permanent":
+            failed += 1
+        else:
+            retry.append(entry)
+
+    if retry:
+        if attempt >= int(getattr(settings, "NOTIFY_MAX_RETRIES", 3)):
+            failed += len(retry)  # final failure; no more retries
+        else:
+            send_reset_password_batch_task.apply_async(args=[batch_id, retry], kwargs={"attempt": attempt + 1},
+                                                       countdown=_backoff(attempt - 1))
+
+    record_progress(batch_id, sent=sent, failed=failed)
+    return {"sent": sent, "failed": failed}
@@ -1,3 +1,96 @@
-from django.test import TestCase
+from unittest import mock
 
-# Create your tests here.
+from bson import ObjectId
+from django.test import SimpleTestCase
+from pymongo.errors import AutoReconnect, BulkWriteError
+
+from . import logging as notify_logging
+from .logging import LogBuffer
+
+
+class _Logs:
+    """notification_logs stand-in: insert_many assigns `_id`s like pymongo and keeps what it stored."""
+
+    def __init__(self):
+        self.stored = {}
+        self.fail = None  # callable(records) -> exception raised after storing, or None
+
+    def insert_many(self, records, ordered=True):
+        written, errors = 0, []
+        for i, r in enumerate(records):
+            r.setdefault("_id", ObjectId())
+            if r["_id"] in self.stored:
+                errors.append({"index": i, "code": 11000, "errmsg": "E11000 duplicate key error"})
+            else:
+                self.stored[r["_id"]] = dict(r)
+                written += 1
+        exc = self.fail(records) if self.fail else None
+        if errors and exc is None:
+            exc = BulkWriteError({"writeErrors": errors, "nInserted": written})
+        if exc is not None:
+            raise exc
+
+
+class LogBufferTests(SimpleTestCase):
+    def setUp(self):
+        self.logs = _Logs()
+        for target, value in [("get_collection", lambda name: self.logs), ("monotonic", lambda: self.now)]:
+            patcher = mock.patch.object(notify_logging, target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(LogBuffer, "_ensure_flusher")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.now = 100.0
+
+    def test_flushes_on_size(self):
+        buf = LogBuffer(max_records=3, max_delay=60)
+        buf.add({"n": 1})
+        buf.add({"n": 2})
+        self.assertEqual(self.logs.stored, {})
+        buf.add({"n": 3})
+        self.assertEqual(sorted(r["n"] for r in self.logs.stored.values()), [1, 2, 3])
+        self.assertEqual(buf.flush(), 0)
+
+    def test_flushes_on_age(self):
+        buf = LogBuffer(max_records=100, max_delay=2)
+        buf.add({"n": 1})
+        self.assertEqual(buf.flush(only_due=True), 0)
+        self.now += 2
+        buf.add({"n": 2})
+        self.assertEqual(len(self.logs.stored), 2)
+
+    def test_ambiguous_failure_is_not_written_twice(self):
+        buf = LogBuffer(max_records=100, max_delay=60)
+        for n in range(4):
+            buf.add({"n": n})
+        # stored, but the reply was lost
+        self.logs.fail = lambda records: AutoReconnect("connection reset")
+        with self.assertRaises(AutoReconnect):
+            buf.flush()
+        self.logs.fail = None
+        buf.add({"n": 4})
+        self.assertEqual(buf.flush(), 1)
+        self.assertEqual(sorted(r["n"] for r in self.logs.stored.values()), [0, 1, 2, 3, 4])
+        self.assertEqual(buf.flush(), 0)
+
+    def test_requeues_only_records_that_failed(self):
+        buf = LogBuffer(max_records=100, max_delay=60)
+        for n in range(4):
+            buf.add({"n": n})
+
+        def reject_odd(records):
+            errors = [{"index": i, "code": 121, "errmsg": "validation"} for i, r in enumerate(records) if r["n"] % 2]
+            for r in records:
+                if r["n"] % 2:
+                    self.logs.stored.pop(r["_id"])
+            return BulkWriteError({"writeErrors": errors, "nInserted": len(records) - len(errors)})
+
+        self.logs.fail = reject_odd
+        with self.assertRaises(BulkWriteError):
+            buf.flush()
+        self.assertEqual(sorted(r["n"] for r in self.logs.stored.values()), [0, 2])
+        self.assertEqual(sorted(r["n"] for r in buf._records), [1, 3])
+        self.logs.fail = None
+        self.assertEqual(buf.flush(), 2)
+        self.assertEqual(sorted(r["n"] for r in self.logs.stored.values()), [0, 1, 2, 3])
@@ -1,7 +1,10 @@
 from django.urls import path
-from .views import ResetPasswordNotifyView,ResetPasswordNotifyTelegramView
+from .views import (ResetPasswordNotifyView, ResetPasswordNotifyTelegramView, ResetPasswordBulkNotifyView,
+                    NotificationBatchStatusView)
 
 urlpatterns = [
     path("reset-password/", ResetPasswordNotifyView.as_view(), name="notify-reset-password"),
     path("reset-password/telegram/", ResetPasswordNotifyTelegramView.as_view(), name="notify-reset-password-telegram"),
+    path("reset-password/bulk/", ResetPasswordBulkNotifyView.as_view(), name="notify-reset-password-bulk"),
+    path("batches/<str:batch_id>/", NotificationBatchStatusView.as_view(), name="notify-batch-status"),
 ]
\ No newline at end of file
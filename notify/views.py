@@ -3,8 +3,12 @@ from rest_framework.response import Response
 from rest_framework import status
 from django.conf import settings
 
-from .serializers import ResetPasswordRequestSerializer, ResetPasswordRequestTelegramSerializer
-from .tasks import send_reset_password_task
+from celery import group
+
+from .serializers import (ResetPasswordRequestSerializer, ResetPasswordRequestTelegramSerializer,
+                          ResetPasswordBulkRequestSerializer)
+from .tasks import send_reset_password_task, send_reset_password_batch_task
+from .batches import create_batch, get_batch
 
 class ResetPasswordNotifyView(APIView):
     def post(self, request):
@@ -36,3 +40,36 @@ class ResetPasswordNotifyTelegramView(APIView):
         async_result = send_reset_password_task.delay(merchant_id=merchant_id, channel="telegram", lang=lang, chat_id=chat_id)
         return Response({"task_id": async_result.id, "status": "queued"}, status=status.HTTP_201_CREATED)
 
+
+class ResetPasswordBulkNotifyView(APIView):
+    """
+    Many (merchantId, channel, lang) entries validated in one pass and queued
+    as a group of chunk tasks (NOTIFY_BULK_CHUNK_SIZE entries each), so broker
+    traffic is one message per chunk instead of one per recipient.
+    """
+    def post(self, request):
+        s = ResetPasswordBulkRequestSerializer(data=request.data)
+        if not s.is_valid():
+            return Response(s.errors, status=status.HTTP_400_BAD_REQUEST)
+        default_lang = getattr(settings, "NOTIFY_DEFAULT_LANG", "fa")
+        entries = []
+        for e in s.validated_data["entries"]:
+            entry = {"merchant_id": e["merchantId"], "channel": e["channel"], "lang": e.get("lang") or default_lang}
+            if e["channel"] == "telegram" and e.get("chat_id") is not None:
+                entry["chat_id"] = e["chat_id"]
+            entries.append(entry)
+
+        size = int(getattr(settings, "NOTIFY_BULK_CHUNK_SIZE", 200))
+        chunks = [entries[i:i + size] for i in range(0, len(entries), size)]
+        batch_id = create_batch(total=len(entries), chunks=len(chunks))
+        group(send_reset_password_batch_task.s(batch_id, chunk) for chunk in chunks).apply_async()
+        return Response({"batch_id": batch_id, "status": "queued", "total": len(entries), "chunks": len(chunks)},
+                        status=status.HTTP_201_CREATED)
+
+
+class NotificationBatchStatusView(APIView):
+    def get(self, request, batch_id):
+        batch = get_batch(batch_id)
+        if batch is None:
+            return Response({"detail": "Not found."}, status=status.HTTP_404_NOT_FOUND)
+        return Response(batch, status=status.HTTP_200_OK)
@@ -0,0 +1,16 @@
+import os
+import redis
+from django.conf import settings
+
+_client = None
+_pid = None
+
+
+def get_redis():
+    """Process-wide Redis client on REDIS_URL, re-created lazily in a forked child."""
+    global _client, _pid
+    if _client is None or _pid != os.getpid():
+        timeout = settings.REDIS_SOCKET_TIMEOUT
+        _client = redis.Redis.from_url(settings.REDIS_URL, socket_timeout=timeout, socket_connect_timeout=timeout)
+        _pid = os.getpid()
+    return _client
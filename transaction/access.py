@@ -0,0 +1,50 @@
+import random
+from datetime import datetime, timezone, timedelta
+from bson import ObjectId
+from django.conf import settings
+from redis.exceptions import RedisError
+
+from redis_client import get_redis
+from .summary import scope_key
+
+# One sorted set per UTC hour (scope key -> estimated report requests); the
+# hottest scopes are the union over the last REPORT_ACCESS_WINDOW_HOURS.
+_KEY = "summary:access:{:%Y%m%d%H}"
+_TOP_KEY = "summary:access:top"
+
+
+def _window_hours() -> int:
+    return int(getattr(settings, "REPORT_ACCESS_WINDOW_HOURS", 24))
+
+
+def record_access(merchants):
+    """
+    Count report requests per summary scope (None is the global scope).
+    Only a REPORT_ACCESS_SAMPLE_RATE fraction of calls touches Redis, each
+    adding 1/rate, so the counters stay unbiased at a fraction of the cost.
+    Never raises.
+    """
+    rate = float(getattr(settings, "REPORT_ACCESS_SAMPLE_RATE", 0.1))
+    if rate <= 0 or random.random() >= rate:
+        return
+    key = _KEY.format(datetime.now(timezone.utc))
+    try:
+        pipe = get_redis().pipeline(transaction=False)
+        for merchant in set(merchants):
+            pipe.zincrby(key, 1 / rate, scope_key(merchant))
+        pipe.expire(key, (_window_hours() + 1) * 3600)
+        pipe.execute()
+    except RedisError:
+        pass
+
+
+def hottest_scopes(n: int) -> list:
+    """Up to n most requested scopes over the access window, hottest first (None is the global scope)."""
+    now = datetime.now(timezone.utc)
+    keys = [_KEY.format(now - timedelta(hours=h)) for h in range(_window_hours())]
+    pipe = get_redis().pipeline()
+    pipe.zunionstore(_TOP_KEY, keys)
+    pipe.zrevrange(_TOP_KEY, 0, n - 1)
+    pipe.delete(_TOP_KEY)
+    _, top, _ = pipe.execute()
+    return [ObjectId(m.decode()) if ObjectId.is_valid(m.decode()) else None for m in top]
@@ -0,0 +1,109 @@
+import threading
+import uuid
+from contextlib import contextmanager
+from time import monotonic, sleep, time
+from django.conf import settings
+from redis.exceptions import RedisError
+
+from redis_client import get_redis
+
+_GLOBAL_KEY = "report:aggregations"
+
+
+class Overloaded(Exception):
+    """No raw-aggregation slot became free within REPORT_ADMISSION_WAIT_MS."""
+
+
+def max_time_ms(mode: str):
+    """Server-side time budget of a raw report aggregation for `mode` (None: unlimited)."""
+    return getattr(settings, "REPORT_MAX_TIME_MS", {}).get(mode)
+
+
+class AggregationGate:
+    """
+    Caps concurrent raw report aggregations: at most `limit` per process and,
+    when `global_limit` is set, at most that many across all processes,
+    tracked in a Redis sorted set of (token, start time). Entries older than
+    `stale_after` seconds (a crashed holder) stop counting. Callers wait up to
+    `wait_ms` for a slot, then get Overloaded. If Redis is unreachable only the
+    per-process limit applies.
+    """
+
+    def __init__(self, limit: int, global_limit: int, wait_ms: int, stale_after: float):
+        self.limit = limit
+        self.global_limit = global_limit
+        self.wait_ms = wait_ms
+        self.stale_after = stale_after
+        self._local = threading.BoundedSemaphore(limit)
+
+    def _acquire_global(self, deadline: float):
+        token = uuid.uuid4().hex
+        try:
+            r = get_redis()
+            while True:
+                now = time()
+                pipe = r.pipeline()
+                pipe.zremrangebyscore(_GLOBAL_KEY, '-inf', now - self.stale_after)
+                pipe.zadd(_GLOBAL_KEY, {token: now})
+                pipe.zrank(_GLOBAL_KEY, token)
+                pipe.expire(_GLOBAL_KEY, int(self.stale_after) + 1)
+                rank = pipe.execute()[2]
+                if rank is not None and rank < self.global_limit:
+                    return token
+                r.zrem(_GLOBAL_KEY, token)
+                if monotonic() >= deadline:
+                    raise Overloaded()
+                sleep(0.02)
+        except RedisError:
+            return None
+
+    def _release_global(self, token):
+        try:
+            get_redis().zrem(_GLOBAL_KEY, token)
+        except RedisError:
+            pass
+
+    def acquire(self):
+        """Take a slot, waiting up to wait_ms; returns the callable that frees it (safe to call twice)."""
+        deadline = monotonic() + self.wait_ms / 1000
+        if not self._local.acquire(timeout=self.wait_ms / 1000):
+            raise Overloaded()
+        try:
+            token = self._acquire_global(deadline) if self.global_limit else None
+        except BaseException:
+            self._local.release()
+            raise
+
+        held = True
+
+        def release():
+            nonlocal held
+            if not held:
+                return
+            held = False
+            if token:
+                self._release_global(token)
+            self._local.release()
+        return release
+
+    @contextmanager
+    def slot(self):
+        release = self.acquire()
+        try:
+            yield
+        finally:
+            release()
+
+    def run(self, compute):
+        """compute() inside a slot."""
+        with self.slot():
+            return compute()
+
+
+aggregation_gate = AggregationGate(
+    limit=int(getattr(settings, "REPORT_MAX_CONCURRENT_AGGREGATIONS", 4)),
+    global_limit=int(getattr(settings, "REPORT_GLOBAL_MAX_AGGREGATIONS", 0)),
+    wait_ms=int(getattr(settings, "REPORT_ADMISSION_WAIT_MS", 250)),
+    # a holder can't legitimately outlive the longest query budget
+    stale_after=max([v for v in getattr(settings, "REPORT_MAX_TIME_MS", {}).values() if v] or [60000]) / 1000 + 5,
+)
@@ -0,0 +1,119 @@
+import asyncio
+import json
+from django.http import HttpResponse, JsonResponse
+from django.views import View
+from pymongo.errors import ExecutionTimeout
+from mongo import get_async_collection
+from .serializers import ReportQuerySerializer
+from .report_cache import report_cache
+from .helpers import aaggregate_buckets_both
+from .summary import SERIES_COLLECTION, series_key, asummary_age, is_stale
+from .tasks import request_rebuild
+from .access import record_access
+from .admission import Overloaded, aggregation_gate, max_time_ms
+from .views import report_match, summary_filter, series_projection, series_body
+
+# Same body as DRF's JSONRenderer produces for the sync views
+_JSON_PARAMS = {'ensure_ascii': False, 'separators': (',', ':')}
+
+
+def _json(data, status=200, headers=None):
+    return JsonResponse(data, status=status, safe=False, json_dumps_params=_JSON_PARAMS, headers=headers)
+
+
+def _validated(request):
+    """Parse the JSON body like DRF's JSONParser; returns (validated_data, error_response)."""
+    try:
+        body = json.loads(request.body or b'{}')
+    except ValueError as e:
+        return None, _json({'detail': f'JSON parse error - {e}'}, status=400)
+    q = ReportQuerySerializer(data=body)
+    if not q.is_valid():
+        return None, _json(q.errors, status=400)
+    return q.validated_data, None
+
+
+async def _summary_docs(qd, metric: str) -> list:
+    coll = get_async_collection('transaction_summary', route='reports')
+    proj = {'_id': 0, 'label_jalali': 1, metric: 1}
+    limit = qd.get('limit')
+    if limit:
+        return (await coll.find(summary_filter(qd), proj).sort('bucket_start', -1).limit(limit).to_list())[::-1]
+    return await coll.find(summary_filter(qd), proj).sort('bucket_start', 1).to_list()
+
+
+async def _live_rows(qd):
+    """Raw aggregation of a report query inside an aggregation slot; raises Overloaded when none frees up in time."""
+    mode = qd['mode']
+    release = await asyncio.to_thread(aggregation_gate.acquire)
+    try:
+        coll = get_async_collection('transaction', route='reports')
+        return await aaggregate_buckets_both(coll, report_match(qd), mode, max_time_ms(mode))
+    finally:
+        await asyncio.to_thread(release)
+
+
+async def _degraded(qd, metric: str, age):
+    if age is None:
+        return _json({'detail': 'Report capacity exhausted, retry shortly'}, status=503, headers={'Retry-After': '1'})
+    docs = await _summary_docs(qd, metric)
+    return _json([{'key': d['label_jalali'], 'value': d.get(metric, 0)} for d in docs],
+                 headers={'X-Report-Degraded': 'summary'})
+
+
+class TransactionReportAsyncView(View):
+    """
+    Async TransactionReportView for ASGI: the aggregation awaits the async
+    Mongo driver, so a slow report holds no worker thread while it runs.
+    """
+    async def get(self, request):
+        qd, err = _validated(request)
+        if err:
+            return err
+        metric, mode = qd['type'], qd['mode']
+        await asyncio.to_thread(record_access, [qd.get('merchantId')])
+
+        key = (qd.get('merchantId'), mode, qd.get('date_from'), qd.get('date_to'))
+        try:
+            rows = await report_cache.aget_or_compute(key, lambda: _live_rows(qd))
+        except (Overloaded, ExecutionTimeout):
+            state = get_async_collection('transaction_summary_state', route='reports')
+            return await _degraded(qd, metric, await asummary_age(state, qd.get('merchantId')))
+        if qd.get('limit'):
+            rows = rows[-qd['limit']:]
+
+        return _json([{'key': r['label_jalali'], 'value': r[metric]} for r in rows])
+
+
+class TransactionReportCachedAsyncView(View):
+    """Async TransactionReportCachedView for ASGI."""
+    async def get(self, request):
+        qd, err = _validated(request)
+        if err:
+            return err
+        type = qd['type']
+        await asyncio.to_thread(record_access, [qd.get('merchantId')])
+
+        state = get_async_collection('transaction_summary_state', route='reports')
+        age = await asummary_age(state, qd.get('merchantId'))
+        if age is None or is_stale(age):
+            await asyncio.to_thread(request_rebuild, qd.get('merchantId'))
+        if age is None:
+            try:
+                rows = await _live_rows(qd)
+            except (Overloaded, ExecutionTimeout):
+                return await _degraded(qd, type, age)
+            if qd.get('limit'):
+                rows = rows[-qd['limit']:]
+            return _json([{'key': r['label_jalali'], 'value': r[type]} for r in rows])
+
+        series = get_async_collection(SERIES_COLLECTION, route='reports')
+        doc = await series.find_one({'_id': series_key(qd.get('merchantId'), qd['mode'])}, series_projection(qd, type))
+        if doc is not None:
+            response = HttpResponse(series_body(doc, qd, type), content_type='application/json')
+        else:
+            docs = await _summary_docs(qd, type)
+            response = _json([{'key': d['label_jalali'], 'value': d.get(type, 0)} for d in docs])
+        if is_stale(age):
+            response['X-Summary-Stale'] = str(int(age))
+        return response
@@ -1,16 +1,25 @@
+import threading
 from datetime import datetime, timedelta, date as _date
+from zoneinfo import ZoneInfo
 import jdatetime
+import numpy as np
 
 TZ = 'Asia/Tehran'
+TEHRAN = ZoneInfo(TZ)
+MODES = ['daily', 'weekly', 'monthly']
 PERSIAN_MONTHS = ["فروردین","اردیبهشت","خرداد","تیر","مرداد","شهریور",
                   "مهر","آبان","آذر","دی","بهمن","اسفند"]
 
+# Jalali years covered by the calendar index up front; it grows on demand,
+# but never past CALENDAR_MARGIN_YEARS either side of them.
+CALENDAR_YEARS = (1390, 1410)
+CALENDAR_MARGIN_YEARS = 60
+CALENDAR_LIMITS = (CALENDAR_YEARS[0] - CALENDAR_MARGIN_YEARS, CALENDAR_YEARS[1] + CALENDAR_MARGIN_YEARS)
+# Below this many daily rows the plain-Python rollup beats the NumPy setup cost.
+ROLLUP_NUMPY_MIN_ROWS = 512
 
-def jalali_label(g_date: _date, mode: str) -> str:
-    """Format a Gregorian date into a Jalali label per mode."""
-    if hasattr(g_date, 'date'):
-        g_date = g_date.date()
-    jd = jdatetime.date.fromgregorian(date=g_date)
+
+def _format_label(jd: jdatetime.date, mode: str) -> str:
     if mode == 'daily':
         return f"{jd.year:04d}/{jd.month:02d}/{jd.day:02d}"
     if mode == 'monthly':
@@ -21,31 +30,190 @@ def jalali_label(g_date: _date, mode: str) -> str:
     raise ValueError("invalid mode")
 
 
-def label_to_gregorian_date(mode: str, label: str) -> _date:
-    """Inverse of jalali_label function: map a label back to Gregorian start date for correct ordering."""
-    if mode == 'daily':
-        y, m, d = map(int, label.split('/'))
-        return jdatetime.date(y, m, d).togregorian()
-    if mode == 'monthly':
-        y_str, mname = label.split()
-        y = int(y_str)
-        idx = PERSIAN_MONTHS.index(mname) + 1
-        return jdatetime.date(y, idx, 1).togregorian()
-    if mode == 'weekly':
-        parts = label.split()
-        y, w = int(parts[1]), int(parts[3])
-        start = jdatetime.date(y, 1, 1).togregorian()
-        return start + timedelta(days=(w-1)*7)
-    raise ValueError("invalid mode")
+class JalaliCalendar:
+    """
+    Lookup tables for whole Jalali years [first_year, last_year], indexed by
+    Gregorian day ordinal. For every day and mode they hold the bucket label
+    and the ordinals of the bucket's first day and of the day after it; each
+    label maps back to its bucket's first-day ordinal. Buckets never cross a
+    Jalali year, so whole years always hold whole buckets.
+    """
+
+    def __init__(self, first_year: int, last_year: int):
+        self.first_year, self.last_year = first_year, last_year
+        self.first = jdatetime.date(first_year, 1, 1).togregorian().toordinal()
+        self.last = jdatetime.date(last_year + 1, 1, 1).togregorian().toordinal() - 1
+        n = self.last - self.first + 1
+
+        self.labels = {m: [None] * n for m in MODES}
+        self.starts = {m: [0] * n for m in MODES}
+        self.ends = {m: [0] * n for m in MODES}
+        self.label_starts = {m: {} for m in MODES}
+
+        jd = jdatetime.date(first_year, 1, 1)
+        one_day = timedelta(days=1)
+        for i in range(n):
+            for m in MODES:
+                label = _format_label(jd, m)
+                starts = self.label_starts[m]
+                if label not in starts:
+                    starts[label] = self.first + i
+                self.labels[m][i] = label
+                self.starts[m][i] = starts[label]
+            jd += one_day
 
+        for m in MODES:
+            labels, ends = self.labels[m], self.ends[m]
+            ends[n - 1] = self.last + 1
+            for i in range(n - 2, -1, -1):
+                ends[i] = ends[i + 1] if labels[i] == labels[i + 1] else self.first + i + 1
 
+    def start_array(self, mode: str) -> np.ndarray:
+        """bucket_ordinal() for every covered day as an int64 array, indexed by ordinal - first."""
+        arrays = self.__dict__.setdefault('_start_arrays', {})
+        arr = arrays.get(mode)
+        if arr is None:
+            arr = arrays[mode] = np.asarray(self.starts[mode], dtype=np.int64)
+        return arr
 
-def aggregate_daily_both(coll, match: dict):
+    def covers(self, ordinal: int) -> bool:
+        return self.first <= ordinal <= self.last
+
+    def label(self, ordinal: int, mode: str) -> str:
+        return self.labels[mode][ordinal - self.first]
+
+    def bucket_ordinal(self, ordinal: int, mode: str) -> int:
+        """Ordinal of the first day of the bucket containing `ordinal`; sorts chronologically."""
+        return self.starts[mode][ordinal - self.first]
+
+    def bucket_end_ordinal(self, ordinal: int, mode: str) -> int:
+        return self.ends[mode][ordinal - self.first]
+
+    def label_ordinal(self, mode: str, label: str) -> int:
+        """Inverse of label(): first-day ordinal of the bucket named `label` (KeyError if unknown)."""
+        return self.label_starts[mode][label]
+
+
+_CALENDAR_LOCK = threading.Lock()
+_CALENDAR = None
+
+
+def supported_dates() -> tuple[_date, _date]:
+    """First and last Gregorian day the calendar index may grow to (the Jalali years in CALENDAR_LIMITS)."""
+    first, last = CALENDAR_LIMITS
+    return jdatetime.date(first, 1, 1).togregorian(), jdatetime.date(last + 1, 1, 1).togregorian() - timedelta(days=1)
+
+
+def get_calendar(ordinal: int | None = None, jalali_year: int | None = None) -> JalaliCalendar:
     """
-    Aggregate once per day (Asia/Tehran) and compute both metrics:
-    returns list of tuples: (gregorian_date, count, amount).
+    Process-wide calendar index, rebuilt wider when asked for a day/year it
+    doesn't cover. ValueError for a day/year outside CALENDAR_LIMITS.
     """
-    pipeline = [
+    global _CALENDAR
+    cal = _CALENDAR
+    if cal is not None and (ordinal is None or cal.covers(ordinal)) \
+            and (jalali_year is None or cal.first_year <= jalali_year <= cal.last_year):
+        return cal
+    with _CALENDAR_LOCK:
+        cal = _CALENDAR
+        first, last = (cal.first_year, cal.last_year) if cal else CALENDAR_YEARS
+        if ordinal is not None:
+            y = jdatetime.date.fromgregorian(date=_date.fromordinal(ordinal)).year
+            first, last = min(first, y), max(last, y)
+        if jalali_year is not None:
+            first, last = min(first, jalali_year), max(last, jalali_year)
+        if first < CALENDAR_LIMITS[0] or last > CALENDAR_LIMITS[1]:
+            raise ValueError(f"outside the supported Jalali years {CALENDAR_LIMITS[0]}-{CALENDAR_LIMITS[1]}")
+        if cal is None or (first, last) != (cal.first_year, cal.last_year):
+            _CALENDAR = JalaliCalendar(first, last)
+        return _CALENDAR
+
+
+def jalali_label(g_date: _date, mode: str) -> str:
+    """Format a Gregorian date into a Jalali label per mode."""
+    if hasattr(g_date, 'date'):
+        g_date = g_date.date()
+    if mode not in MODES:
+        raise ValueError("invalid mode")
+    o = g_date.toordinal()
+    return get_calendar(o).label(o, mode)
+
+
+def tehran_date(value) -> _date:
+    """Calendar day (Asia/Tehran) of a stored `createdAt`, like the pipeline's $toDate + $dateToString."""
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=ZoneInfo('UTC'))
+    return value.astimezone(TEHRAN).date()
+
+
+def bucket_start(g_date: _date, mode: str) -> _date:
+    """First Gregorian day of the Jalali bucket (day / Saturday-week / month) containing g_date."""
+    if mode not in MODES:
+        raise ValueError("invalid mode")
+    o = g_date.toordinal()
+    return _date.fromordinal(get_calendar(o).bucket_ordinal(o, mode))
+
+
+def bucket_end(g_date: _date, mode: str) -> _date:
+    """First Gregorian day after the Jalali bucket containing g_date (exclusive end)."""
+    if mode not in MODES:
+        raise ValueError("invalid mode")
+    o = g_date.toordinal()
+    return _date.fromordinal(get_calendar(o).bucket_end_ordinal(o, mode))
+
+
+def tehran_midnight(g_date: _date) -> datetime:
+    return datetime(g_date.year, g_date.month, g_date.day, tzinfo=TEHRAN)
+
+
+def created_at_range(mode: str, date_from: _date | None = None, date_to: _date | None = None) -> dict:
+    """
+    `createdAt` bounds covering whole buckets of `mode` from the bucket of
+    date_from through the bucket of date_to (both optional). Meant to sit in
+    the first $match, next to merchantId, so the index range can be used.
+    """
+    rng = {}
+    if date_from:
+        rng['$gte'] = tehran_midnight(bucket_start(date_from, mode))
+    if date_to:
+        rng['$lt'] = tehran_midnight(bucket_end(date_to, mode))
+    return {'createdAt': rng} if rng else {}
+
+
+def coarsest_mode(modes) -> str:
+    """The mode with the widest buckets; its aligned range covers the aligned ranges of the others."""
+    return max(modes, key=MODES.index)
+
+
+def clip_daily(daily_rows, mode: str, date_from: _date | None = None, date_to: _date | None = None):
+    """Keep the daily rows inside the whole-bucket range of `mode` (see created_at_range)."""
+    lo = bucket_start(date_from, mode) if date_from else None
+    hi = bucket_end(date_to, mode) if date_to else None
+    return [r for r in daily_rows if (lo is None or r[0] >= lo) and (hi is None or r[0] < hi)]
+
+
+def label_ordinal(mode: str, label: str) -> int:
+    """Gregorian ordinal of the first day of the bucket named `label`; integer sort key for labels."""
+    if mode not in MODES:
+        raise ValueError("invalid mode")
+    try:
+        return get_calendar().label_ordinal(mode, label)
+    except KeyError:
+        pass
+    # outside the indexed years: grow the index to the label's year and retry
+    year = int(label.split('/')[0] if mode == 'daily' else label.split()[0 if mode == 'monthly' else 3])
+    return get_calendar(jalali_year=year).label_ordinal(mode, label)
+
+
+def label_to_gregorian_date(mode: str, label: str) -> _date:
+    """Inverse of jalali_label function: map a label back to Gregorian start date for correct ordering."""
+    return _date.fromordinal(label_ordinal(mode, label))
+
+
+def daily_pipeline(match: dict) -> list:
+    return [
         {'$match': match or {}},
         {'$addFields': {'_createdAtDate': {'$toDate': '$createdAt'}}},
         {'$group': {
@@ -57,12 +225,178 @@ def aggregate_daily_both(coll, match: dict):
         }},
         {'$sort': {'_id.day': 1}},
     ]
-    cur = coll.aggregate(pipeline, allowDiskUse=True)
+
+
+def _budget(max_time_ms) -> dict:
+    """aggregate() kwargs for an optional server-side time limit."""
+    return {'maxTimeMS': max_time_ms} if max_time_ms else {}
+
+
+def iter_daily_both(coll, match: dict, max_time_ms: int | None = None):
+    """Streaming form of aggregate_daily_both: yields the tuples straight off the cursor."""
+    cur = coll.aggregate(daily_pipeline(match), allowDiskUse=True, **_budget(max_time_ms))
+    for d in cur:
+        g = datetime.strptime(d['_id']['day'], '%Y-%m-%d').date()
+        yield g, int(d['count']), d['amount']
+
+
+def aggregate_daily_both(coll, match: dict, max_time_ms: int | None = None):
+    """
+    Aggregate once per day (Asia/Tehran) and compute both metrics:
+    returns list of tuples: (gregorian_date, count, amount).
+    """
+    return list(iter_daily_both(coll, match, max_time_ms))
+
+
+def created_at_span(coll, match: dict, max_time_ms: int | None = None):
+    """(oldest, newest) `createdAt` among documents matching `match`, or None if there are none."""
+    first = coll.find_one(match or {}, {'createdAt': 1}, sort=[('createdAt', 1)], max_time_ms=max_time_ms)
+    if first is None:
+        return None
+    last = coll.find_one(match or {}, {'createdAt': 1}, sort=[('createdAt', -1)], max_time_ms=max_time_ms)
+    return first['createdAt'], last['createdAt']
+
+
+def bucket_boundaries(mode: str, first: _date, last: _date) -> list:
+    """Tehran-midnight instants of every bucket start from first's bucket through the end of last's."""
+    o, end = bucket_start(first, mode).toordinal(), last.toordinal()
+    cal = get_calendar(o)
+    out = [o]
+    while o <= end:
+        if not cal.covers(o):
+            cal = get_calendar(o)
+        o = cal.bucket_end_ordinal(o, mode)
+        out.append(o)
+    return [tehran_midnight(_date.fromordinal(x)) for x in out]
+
+
+def _bucket_pipeline(match: dict, boundaries: list) -> list:
+    return [
+        {'$match': match or {}},
+        {'$addFields': {'_createdAtDate': {'$toDate': '$createdAt'}}},
+        {'$bucket': {
+            'groupBy': '$_createdAtDate',
+            'boundaries': boundaries,
+            'default': 'outside',  # only docs inserted after the span was read
+            'output': {'count': {'$sum': 1}, 'amount': {'$sum': '$amount'}},
+        }},
+    ]
+
+
+def _bucket_rows(docs, mode: str) -> list:
     out = []
+    for d in docs:
+        if d['_id'] == 'outside':
+            continue
+        g = tehran_date(d['_id'])
+        out.append((g.toordinal(), {'label_jalali': jalali_label(g, mode), 'count': int(d['count']), 'amount': d['amount']}))
+    out.sort(key=lambda kv: kv[0])
+    return [row for _, row in out]
+
+
+def aggregate_buckets_both(coll, match: dict, mode: str, max_time_ms: int | None = None):
+    """
+    Weekly/monthly counterpart of aggregate_daily_both + rollup_both that
+    groups on the server: Jalali bucket boundaries are computed here as
+    Gregorian instants and handed to $bucket, so only one row per output
+    bucket crosses the wire. Returns the same rows as rollup_both.
+    max_time_ms applies to each query separately.
+    """
+    if mode == 'daily':
+        return rollup_both(aggregate_daily_both(coll, match, max_time_ms), mode)
+    span = created_at_span(coll, match, max_time_ms)
+    if span is None:
+        return []
+    boundaries = bucket_boundaries(mode, tehran_date(span[0]), tehran_date(span[1]))
+    cur = coll.aggregate(_bucket_pipeline(match, boundaries), allowDiskUse=True, **_budget(max_time_ms))
+    return _bucket_rows(cur, mode)
+
+
+# Async counterparts for the ASGI views (pymongo AsyncCollection)
+
+async def acreated_at_span(coll, match: dict, max_time_ms: int | None = None):
+    first = await coll.find_one(match or {}, {'createdAt': 1}, sort=[('createdAt', 1)], max_time_ms=max_time_ms)
+    if first is None:
+        return None
+    last = await coll.find_one(match or {}, {'createdAt': 1}, sort=[('createdAt', -1)], max_time_ms=max_time_ms)
+    return first['createdAt'], last['createdAt']
+
+
+async def aaggregate_daily_both(coll, match: dict, max_time_ms: int | None = None):
+    cur = await coll.aggregate(daily_pipeline(match), allowDiskUse=True, **_budget(max_time_ms))
+    return [
+        (datetime.strptime(d['_id']['day'], '%Y-%m-%d').date(), int(d['count']), d['amount'])
+        async for d in cur
+    ]
+
+
+async def aaggregate_buckets_both(coll, match: dict, mode: str, max_time_ms: int | None = None):
+    if mode == 'daily':
+        return rollup_both(await aaggregate_daily_both(coll, match, max_time_ms), mode)
+    span = await acreated_at_span(coll, match, max_time_ms)
+    if span is None:
+        return []
+    boundaries = bucket_boundaries(mode, tehran_date(span[0]), tehran_date(span[1]))
+    cur = await coll.aggregate(_bucket_pipeline(match, boundaries), allowDiskUse=True, **_budget(max_time_ms))
+    return _bucket_rows([d async for d in cur], mode)
+
+
+def iter_daily_by_merchant(coll, match: dict):
+    """
+    Single-pass variant of aggregate_daily_both grouped by (merchantId, day).
+    Streams the cursor and yields (merchantId, [(gregorian_date, count, amount), ...])
+    one merchant at a time, so only one merchant's rows are held in memory.
+    """
+    pipeline = [
+        {'$match': {'merchantId': {'$exists': True}, **(match or {})}},
+        {'$addFields': {'_createdAtDate': {'$toDate': '$createdAt'}}},
+        {'$group': {
+            '_id': {
+                'merchantId': '$merchantId',
+                'day': {'$dateToString': {
+                    'format': '%Y-%m-%d', 'date': '$_createdAtDate', 'timezone': TZ
+                }},
+            },
+            'count': {'$sum': 1},
+            'amount': {'$sum': '$amount'}
+        }},
+        {'$sort': {'_id.merchantId': 1, '_id.day': 1}},
+    ]
+    cur = coll.aggregate(pipeline, allowDiskUse=True)
+    merchant, rows = None, []
     for d in cur:
+        m = d['_id']['merchantId']
+        if rows and m != merchant:
+            yield merchant, rows
+            rows = []
+        merchant = m
         g = datetime.strptime(d['_id']['day'], '%Y-%m-%d').date()
-        out.append((g, int(d['count']), d['amount']))
-    return out
+        rows.append((g, int(d['count']), d['amount']))
+    if rows:
+        yield merchant, rows
+
+
+def iter_rollup_daily(daily_rows):
+    """Lazy daily-mode rollup_both, for streaming responses."""
+    for g, c, a in daily_rows:
+        yield {'label_jalali': jalali_label(g, 'daily'), 'count': c, 'amount': a}
+
+
+def _rollup_numpy(days: np.ndarray, counts: np.ndarray, amounts: np.ndarray, mode: str):
+    """Grouped sums of daily rows: day ordinals -> bucket ordinals via the calendar, then reduceat per bucket."""
+    cal = get_calendar(int(days.min()))
+    if not cal.covers(int(days.max())):
+        cal = get_calendar(int(days.max()))
+    keys = cal.start_array(mode)[days - cal.first]
+    order = np.argsort(keys, kind='stable')
+    keys = keys[order]
+    firsts = np.concatenate(([0], np.flatnonzero(np.diff(keys)) + 1))
+    count_sums = np.add.reduceat(counts[order], firsts).tolist()
+    amount_sums = np.add.reduceat(amounts[order], firsts).tolist()
+    return [
+        {'label_jalali': cal.label(key, mode), 'count': c, 'amount': a}
+        for key, c, a in zip(keys[firsts].tolist(), count_sums, amount_sums)
+    ]
 
 
 def rollup_both(daily_rows, mode: str):
@@ -71,19 +405,38 @@ def rollup_both(daily_rows, mode: str):
     Returns list of {'label_jalali', 'count', 'amount'} in chronological order.
     """
     if mode == 'daily':
-        return [
-            {'label_jalali': jalali_label(g, 'daily'), 'count': c, 'amount': a}
-            for g, c, a in daily_rows
-        ]
-    # weekly/monthly: bucket in Python using the same Jalali logic
+        return list(iter_rollup_daily(daily_rows))
+    if not isinstance(daily_rows, list):
+        daily_rows = list(daily_rows)
+
+    # large inputs with integer amounts (rials) take the array path when no
+    # bucket's sum can leave int64 (checked on Python ints), so its sums are
+    # exact and it returns the same values as the loop below
+    if len(daily_rows) >= ROLLUP_NUMPY_MIN_ROWS and all(type(a) is int for _, _, a in daily_rows) \
+            and sum(abs(a) for _, _, a in daily_rows) < 2 ** 63 and sum(abs(c) for _, c, _ in daily_rows) < 2 ** 63:
+        days = np.fromiter((g.toordinal() for g, _, _ in daily_rows), dtype=np.int64, count=len(daily_rows))
+        counts = np.fromiter((c for _, c, _ in daily_rows), dtype=np.int64, count=len(daily_rows))
+        amounts = np.fromiter((a for _, _, a in daily_rows), dtype=np.int64, count=len(daily_rows))
+        return _rollup_numpy(days, counts, amounts, mode)
+
+    # weekly/monthly: bucket on integer bucket ordinals, label only the final buckets
     buckets = {}
+    cal = None
     for g, c, a in daily_rows:
-        label = jalali_label(g, mode)
-        if label not in buckets:
-            buckets[label] = {'count': 0, 'amount': 0}
-        buckets[label]['count'] += c
-        buckets[label]['amount'] += a
-
-    ordered = sorted(buckets.items(), key=lambda kv: label_to_gregorian_date(mode, kv[0]))
-    return [{'label_jalali': lbl, **vals} for lbl, vals in ordered]
-    
\ No newline at end of file
+        o = g.toordinal()
+        if cal is None or not cal.covers(o):
+            cal = get_calendar(o)
+        key = cal.bucket_ordinal(o, mode)
+        acc = buckets.get(key)
+        if acc is None:
+            buckets[key] = [c, a]
+        else:
+            acc[0] += c
+            acc[1] += a
+
+    out = []
+    for key in sorted(buckets):
+        cal = cal if cal.covers(key) else get_calendar(key)
+        c, a = buckets[key]
+        out.append({'label_jalali': cal.label(key, mode), 'count': c, 'amount': a})
+    return out
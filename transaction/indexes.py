@@ -0,0 +1,42 @@
+from datetime import timedelta
+from bson import ObjectId
+from django.utils import timezone
+from .helpers import daily_pipeline, created_at_range, tehran_date
+from .views import summary_filter
+
+# Indexes on the raw `transaction` collection (summary indexes live in summary.ensure_indexes)
+INDEXES = [
+    # per-merchant reports: merchantId equality + createdAt range/sort
+    {'collection': 'transaction', 'keys': [('merchantId', 1), ('createdAt', 1)], 'name': 'merchant_createdAt'},
+    # global reports with a date range, and span/watermark lookups sorted on createdAt
+    {'collection': 'transaction', 'keys': [('createdAt', 1)], 'name': 'createdAt'},
+]
+
+
+def plan_checks(db):
+    """
+    (name, explain command) pairs for the queries the report path runs, using a
+    real merchant id when one exists. Unbounded global reports are skipped:
+    they read every document by design.
+    """
+    tx = db['transaction']
+    sample = tx.find_one({'merchantId': {'$exists': True}}, {'merchantId': 1})
+    merchant = sample['merchantId'] if sample else ObjectId()
+    today = tehran_date(timezone.now())
+    last_30 = created_at_range('daily', today - timedelta(days=30), today)
+
+    return [
+        ('merchant daily report', {'aggregate': 'transaction', 'cursor': {},
+                                   'pipeline': daily_pipeline({'merchantId': merchant})}),
+        ('merchant report, last 30 days', {'aggregate': 'transaction', 'cursor': {},
+                                           'pipeline': daily_pipeline({'merchantId': merchant, **last_30})}),
+        ('global report, last 30 days', {'aggregate': 'transaction', 'cursor': {},
+                                         'pipeline': daily_pipeline(last_30)}),
+        ('merchant createdAt span', {'find': 'transaction', 'filter': {'merchantId': merchant},
+                                     'sort': {'createdAt': -1}, 'limit': 1}),
+        ('global createdAt span', {'find': 'transaction', 'filter': {}, 'sort': {'createdAt': -1}, 'limit': 1}),
+        ('cached merchant report', {'find': 'transaction_summary', 'sort': {'bucket_start': 1},
+                                    'filter': summary_filter({'mode': 'daily', 'merchantId': merchant})}),
+        ('cached global report', {'find': 'transaction_summary', 'sort': {'bucket_start': 1},
+                                  'filter': summary_filter({'mode': 'daily'})}),
+    ]
@@ -1,115 +1,70 @@
 from django.core.management.base import BaseCommand
-from django.conf import settings
 from django.utils import timezone
-from pymongo import UpdateOne
-from pymongo.errors import OperationFailure
-from mongo import get_collection
-from transaction.helpers import aggregate_daily_both, rollup_both
 from bson import ObjectId
-
-TTL_INDEX_NAME = "ttl_createdAt"
-UNIQ_INDEX_NAME = "u_mode_label_merchant"
+from transaction.summary import (MODES, get_collections, build_full, build_incremental, build_all_merchants,
+                                 build_full_parallel, build_all_merchants_parallel)
 
 
 class Command(BaseCommand):
     help = "Build/refresh TTL-backed summaries in `transaction_summary`."
 
     def add_arguments(self, parser):
-        parser.add_argument('--mode', choices=['daily','weekly','monthly'], nargs='*')
+        parser.add_argument('--mode', choices=MODES, nargs='*')
         parser.add_argument('--merchant-id', help='Build merchant-scoped summary; omits for global')
+        parser.add_argument('--all-merchants', action='store_true',
+                            help='Build every merchant-scoped summary in a single aggregation pass')
+        parser.add_argument('--incremental', action='store_true',
+                            help='Only aggregate transactions newer than the saved watermark and merge them in')
+        parser.add_argument('--workers', type=int, default=1,
+                            help='Split a full rebuild across this many processes (by date range, or by merchant with --all-merchants)')
 
     def handle(self, *args, **opts):
-        modes = opts['mode'] or ['daily','weekly','monthly']
+        modes = opts['mode'] or MODES
         merchant_str = opts.get('merchant_id')
+        incremental = opts['incremental']
+        all_merchants = opts['all_merchants']
+        workers = opts['workers']
 
-        tx = get_collection('transaction')
-        out = get_collection('transaction_summary')
+        if incremental and set(modes) != set(MODES):
+            self.stdout.write(self.style.ERROR("--incremental maintains all modes together; drop --mode"))
+            return
+
+        if all_merchants and (merchant_str or incremental):
+            self.stdout.write(self.style.ERROR("--all-merchants can't be combined with --merchant-id or --incremental"))
+            return
+
+        if workers < 1 or (workers > 1 and incremental):
+            self.stdout.write(self.style.ERROR("--workers must be >= 1 and only applies to full rebuilds"))
+            return
 
-        # Ensure indexes (idempotent)
-        ensure_indexes(out)
-        
-        # Build match for raw scan
-        match = {}
         merchant = None
         if merchant_str:
             if ObjectId.is_valid(merchant_str):
                 merchant = ObjectId(merchant_str)
-                match["merchantId"] = merchant
             else:
                 self.stdout.write(self.style.ERROR(f"Not a valid merchant ID: {merchant_str}"))
                 return
 
-        # Aggregate once per day, then roll up
-        daily = aggregate_daily_both(tx, match)
+        # Ensure indexes (idempotent)
+        tx, out, state = get_collections()
         now = timezone.now()
-        bulk = []
-
-        for mode in modes:
-            rows = rollup_both(daily, mode)  # [{'label_jalali','count','amount'}...]
-            for r in rows:
-                doc = {
-                    'mode': mode,
-                    'label_jalali': r['label_jalali'],
-                    'count': int(r['count']),
-                    'amount': r['amount'],
-                    'createdAt': now,
-                }
-                filt = {'mode': mode, 'label_jalali': r['label_jalali']}
-                if merchant:
-                    doc['merchantId'] = merchant
-                    filt['merchantId'] = merchant
-                else:
-                    # enforce "no merchantId field" for global rows
-                    filt['merchantId'] = {'$exists': False}
 
-                update = {'$set': doc, '$unset': {}}
-                if not merchant:
-                    update['$unset']['merchantId'] = ""  # guarantee it’s absent on global docs
-
-                bulk.append(UpdateOne(filt, update, upsert=True))
+        if all_merchants:
+            if workers > 1:
+                n = build_all_merchants_parallel(tx, out, state, modes, workers, now)
+            else:
+                n = build_all_merchants(tx, out, state, modes, now)
+            self.stdout.write(self.style.SUCCESS(f"Upserted {n} docs (modes={modes}, merchant=EACH)"))
+            return
 
-        if bulk:
-            out.bulk_write(bulk, ordered=False)
+        if incremental:
+            n = build_incremental(tx, out, state, merchant, now)
+        elif workers > 1:
+            n = build_full_parallel(tx, out, state, merchant, modes, workers, now)
+        else:
+            n = build_full(tx, out, state, merchant, modes, now)
 
         self.stdout.write(self.style.SUCCESS(
-            f"Upserted {len(bulk)} docs (modes={modes}, merchant={'ALL' if not merchant else merchant})"
+            f"Upserted {n} docs (modes={modes}, merchant={'ALL' if not merchant else merchant}"
+            f"{', incremental' if incremental else ''})"
         ))
-
-
-def ensure_indexes(out):
-    existing = {idx["name"]: idx for idx in out.list_indexes()}
-
-    # TTL index
-    ttl_seconds = int(getattr(settings, "SUMMARY_TTL_SECONDS", 86400))
-    if TTL_INDEX_NAME in existing:
-        current_ttl = existing[TTL_INDEX_NAME].get("expireAfterSeconds")
-        if current_ttl != ttl_seconds:
-            # Update TTL in place (preferred) or fall back to drop+recreate
-            try:
-                out.database.command(
-                    "collMod",
-                    out.name,
-                    index={"name": TTL_INDEX_NAME, "expireAfterSeconds": ttl_seconds},
-                )
-            except OperationFailure:
-                # Older server or mismatch: drop + recreate
-                out.drop_index(TTL_INDEX_NAME)
-                out.create_index(
-                    "createdAt",
-                    expireAfterSeconds=ttl_seconds,
-                    name=TTL_INDEX_NAME,
-                )
-    else:
-        out.create_index(
-            "createdAt",
-            expireAfterSeconds=ttl_seconds,
-            name=TTL_INDEX_NAME,
-        )
-
-    # Uniqueness per bucket: (mode, label_jalali, merchantId?)
-    if UNIQ_INDEX_NAME not in existing:
-        out.create_index(
-            [("mode", 1), ("label_jalali", 1), ("merchantId", 1)],
-            unique=True,
-            name=UNIQ_INDEX_NAME,
-        )
@@ -0,0 +1,74 @@
+from django.core.management.base import BaseCommand, CommandError
+from mongo import get_db
+from transaction import indexes as transaction_indexes
+from transaction.summary import get_collections
+from notify import indexes as notify_indexes
+
+APPS = [transaction_indexes, notify_indexes]
+
+
+def _collscans(node, path=''):
+    """Paths of COLLSCAN stages anywhere under an explain output node."""
+    found = []
+    if isinstance(node, dict):
+        if node.get('stage') == 'COLLSCAN':
+            found.append(path or 'COLLSCAN')
+        for k, v in node.items():
+            if k == 'rejectedPlans':
+                continue
+            found.extend(_collscans(v, f"{path}.{k}" if path else k))
+    elif isinstance(node, list):
+        for i, v in enumerate(node):
+            found.extend(_collscans(v, f"{path}[{i}]"))
+    return found
+
+
+class Command(BaseCommand):
+    help = "Build the Mongo indexes the report/notify queries rely on, and verify their plans avoid COLLSCAN."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check-plans', action='store_true',
+                            help='Explain the real report/notify queries and fail on any COLLSCAN')
+        parser.add_argument('--skip-build', action='store_true', help='Only run the plan checks')
+
+    def handle(self, *args, **opts):
+        db = get_db()
+
+        if not opts['skip_build']:
+            get_collections()  # transaction_summary / _state indexes
+            for app in APPS:
+                for spec in app.INDEXES:
+                    coll = db[spec['collection']]
+                    existing = {i['name']: i for i in coll.list_indexes()}
+                    current = existing.get(spec['name'])
+                    options = spec.get('options', {})
+                    if current is not None:
+                        if list(current['key'].items()) != spec['keys']:
+                            raise CommandError(f"{coll.name}.{spec['name']} exists with different keys: "
+                                               f"{dict(current['key'])}; drop it first")
+                        ttl = options.get('expireAfterSeconds')
+                        if ttl is not None and current.get('expireAfterSeconds') != ttl:
+                            db.command('collMod', coll.name, index={'name': spec['name'], 'expireAfterSeconds': ttl})
+                            self.stdout.write(self.style.SUCCESS(f"~ {coll.name}.{spec['name']} (expireAfterSeconds={ttl})"))
+                            continue
+                        self.stdout.write(f"= {coll.name}.{spec['name']}")
+                        continue
+                    # background is a no-op on MongoDB >= 4.2, whose builds only lock briefly
+                    coll.create_index(spec['keys'], name=spec['name'], background=True, **options)
+                    self.stdout.write(self.style.SUCCESS(f"+ {coll.name}.{spec['name']}"))
+
+        if not opts['check_plans']:
+            return
+
+        failed = []
+        for app in APPS:
+            for name, cmd in app.plan_checks(db):
+                plan = db.command('explain', cmd, verbosity='queryPlanner')
+                scans = _collscans(plan)
+                if scans:
+                    failed.append(name)
+                    self.stdout.write(self.style.ERROR(f"COLLSCAN  {name}  ({scans[0]})"))
+                else:
+                    self.stdout.write(self.style.SUCCESS(f"ok        {name}"))
+        if failed:
+            raise CommandError(f"{len(failed)} query plan(s) fall back to COLLSCAN: {', '.join(failed)}")
@@ -0,0 +1,66 @@
+from time import monotonic
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from pymongo.errors import OperationFailure
+from transaction.summary import STREAM_STATE_ID, SeriesRefresher, get_collections, apply_inserts
+
+
+class Command(BaseCommand):
+    help = "Keep `transaction_summary` live by tailing the `transaction` change stream (needs a replica set)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true',
+                            help='Forget the saved resume token and start from the oldest recorded build point')
+
+    def handle(self, *args, **opts):
+        batch_size = int(getattr(settings, "SUMMARY_STREAM_BATCH_SIZE", 500))
+        max_wait_ms = int(getattr(settings, "SUMMARY_STREAM_MAX_WAIT_MS", 1000))
+
+        tx, out, state = get_collections()
+        if opts['reset']:
+            state.delete_one({'_id': STREAM_STATE_ID})
+        saved = state.find_one({'_id': STREAM_STATE_ID}) or {}
+        token = saved.get('resumeToken')
+        start = None
+        if token:
+            self.stdout.write(f"Watching `{tx.name}` (resuming)")
+        else:
+            # replay from the oldest build's read point so nothing inserted since is missed;
+            # apply_inserts skips what each scope's build already counted
+            oldest = state.find_one({'builtAt': {'$exists': True}}, {'builtAt': 1}, sort=[('builtAt', 1)])
+            start = oldest['builtAt'] if oldest else None
+            self.stdout.write(f"Watching `{tx.name}` ({f'from build point {start}' if start else 'from now'})")
+            if start is None:
+                self.stdout.write(self.style.WARNING(
+                    "No build point recorded: inserts since the last build are only picked up by the next build"))
+
+        refreshed = {}
+        series = SeriesRefresher(out, float(getattr(settings, "SUMMARY_SERIES_REFRESH_SECONDS", 10)))
+        pipeline = [{'$match': {'operationType': 'insert'}}]
+        try:
+            stream = tx.watch(pipeline, resume_after=token, start_at_operation_time=start,
+                              max_await_time_ms=max_wait_ms)
+        except OperationFailure as e:
+            raise CommandError(f"Can't open the change stream there ({e}); the oplog may no longer reach it. "
+                               "Rebuild the summaries and start again.")
+        with stream:
+            batch = []
+            deadline = monotonic() + max_wait_ms / 1000
+            try:
+                while stream.alive:
+                    change = stream.try_next()
+                    if change is not None:
+                        batch.append(change)
+                    # flush on size, on an idle stream, or when the batch has waited long enough
+                    if batch and (len(batch) >= batch_size or change is None or monotonic() >= deadline):
+                        now = timezone.now()
+                        # the resume token is saved in the same transaction as the batch's increments
+                        n = apply_inserts(out, state, batch, now, refreshed, series, resume_token=batch[-1]['_id'])
+                        self.stdout.write(f"Applied {len(batch)} inserts ({n} bucket updates)")
+                        batch = []
+                    if not batch:
+                        series.flush()
+                        deadline = monotonic() + max_wait_ms / 1000
+            finally:
+                series.flush(force=True)
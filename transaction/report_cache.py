@@ -0,0 +1,172 @@
+import asyncio
+import threading
+from collections import OrderedDict
+from time import monotonic
+from django.conf import settings
+from redis.exceptions import RedisError
+
+from redis_client import get_redis
+
+# Invalidation counters shared by every process: field per scope, plus "*" for everything
+_GENERATIONS_KEY = "report:cache:generations"
+_EVERYTHING = "*"
+
+
+def _scope_field(merchant_id) -> str:
+    return str(merchant_id) if merchant_id else 'global'
+
+
+class _Flight:
+    """One in-progress computation that concurrent misses for the same key wait on."""
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class ReportCache:
+    """
+    Bounded LRU + TTL cache of report rows keyed by (merchantId, mode, from, to),
+    with single-flight: concurrent misses for one key share a single computation.
+
+    Cached rows carry both `count` and `amount`, so a request for one metric
+    warms the other. Rows are shared between callers and must not be mutated.
+
+    The cache is per process, but invalidate() reaches every process: it bumps
+    the scope's generation counter in Redis, and entries are only served while
+    their scope's generation (re-read at most every `generation_check_seconds`)
+    is the one they were computed under. With Redis unreachable, entries just
+    age out after REPORT_CACHE_TTL_SECONDS.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float, generation_check_seconds: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.generation_check_seconds = generation_check_seconds
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()   # key -> (expires_at, generation, rows)
+        self._generations = {}          # scope field -> (checked_until, generation)
+        self._inflight = {}             # key -> _Flight
+        self._ainflight = {}            # (loop, key) -> asyncio.Future
+
+    def _generation(self, merchant_id):
+        """(scope, everything) invalidation counters from Redis, or None when it can't be reached."""
+        field = _scope_field(merchant_id)
+        now = monotonic()
+        with self._lock:
+            memo = self._generations.get(field)
+            if memo is not None and memo[0] > now:
+                return memo[1]
+        try:
+            generation = tuple(get_redis().hmget(_GENERATIONS_KEY, field, _EVERYTHING))
+        except RedisError:
+            generation = None
+        with self._lock:
+            if len(self._generations) > self.max_entries * 4:
+                self._generations.clear()
+            self._generations[field] = (now + self.generation_check_seconds, generation)
+        return generation
+
+    def _lookup(self, key, generation):
+        # caller holds self._lock
+        hit = self._entries.get(key)
+        if hit is not None:
+            if hit[0] > monotonic() and (generation is None or hit[1] == generation):
+                self._entries.move_to_end(key)
+                return hit
+            del self._entries[key]
+        return None
+
+    def _store(self, key, generation, rows):
+        # caller holds self._lock
+        self._entries[key] = (monotonic() + self.ttl_seconds, generation, rows)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def get_or_compute(self, key, compute):
+        # read before computing, so an invalidation during the computation leaves the result stale
+        generation = self._generation(key[0])
+        with self._lock:
+            hit = self._lookup(key, generation)
+            if hit is not None:
+                return hit[2]
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[key] = _Flight()
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = compute()
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+                if flight.error is None:
+                    self._store(key, generation, flight.result)
+            flight.done.set()
+        return flight.result
+
+    async def aget_or_compute(self, key, compute):
+        """get_or_compute for coroutines: waiters await the leader's future instead of blocking a thread."""
+        loop = asyncio.get_running_loop()
+        generation = await asyncio.to_thread(self._generation, key[0])
+        with self._lock:
+            hit = self._lookup(key, generation)
+            if hit is not None:
+                return hit[2]
+        fut = self._ainflight.get((loop, key))
+        if fut is not None:
+            return await asyncio.shield(fut)
+
+        fut = self._ainflight[(loop, key)] = loop.create_future()
+        try:
+            rows = await compute()
+        except asyncio.CancelledError:
+            fut.cancel()
+            raise
+        except Exception as e:
+            fut.set_exception(e)
+            fut.exception()  # mark retrieved when nobody else was waiting
+            raise
+        else:
+            fut.set_result(rows)
+            with self._lock:
+                self._store(key, generation, rows)
+            return rows
+        finally:
+            self._ainflight.pop((loop, key), None)
+
+    def invalidate(self, merchant_id=None, everything: bool = False):
+        """
+        Drop entries of one scope (merchant_id=None is the global scope), or
+        all of them, here and (through Redis) in every other process. Never raises.
+        """
+        field = _EVERYTHING if everything else _scope_field(merchant_id)
+        with self._lock:
+            if everything:
+                self._entries.clear()
+                self._generations.clear()
+            else:
+                for key in [k for k in self._entries if _scope_field(k[0]) == field]:
+                    del self._entries[key]
+                self._generations.pop(field, None)
+        try:
+            get_redis().hincrby(_GENERATIONS_KEY, field, 1)
+        except RedisError:
+            pass
+
+
+report_cache = ReportCache(
+    max_entries=int(getattr(settings, "REPORT_CACHE_MAX_ENTRIES", 256)),
+    ttl_seconds=float(getattr(settings, "REPORT_CACHE_TTL_SECONDS", 60)),
+    generation_check_seconds=int(getattr(settings, "REPORT_CACHE_INVALIDATION_CHECK_MS", 500)) / 1000,
+)
@@ -1,5 +1,9 @@
+from datetime import date
+from django.conf import settings
 from rest_framework import serializers
 from bson import ObjectId
+import jdatetime
+from .helpers import supported_dates
 
 class ObjectIdField(serializers.Field):
     def to_representation(self, value):
@@ -12,7 +16,53 @@ class ObjectIdField(serializers.Field):
             raise serializers.ValidationError("Invalid ObjectId")
     
 
-class ReportQuerySerializer(serializers.Serializer):
+class FlexibleDateField(serializers.Field):
+    """
+    Accepts `YYYY-MM-DD` or `YYYY/MM/DD`; years before 1700 are read as Jalali.
+    Returns a Gregorian date, which must fall within helpers.supported_dates().
+    """
+    def to_representation(self, value):
+        return value.isoformat()
+
+    def to_internal_value(self, data):
+        try:
+            y, m, d = map(int, str(data).replace('/', '-').split('-'))
+            value = jdatetime.date(y, m, d).togregorian() if y < 1700 else date(y, m, d)
+        except Exception:
+            raise serializers.ValidationError("Invalid date; use YYYY-MM-DD (Jalali or Gregorian)")
+        first, last = supported_dates()
+        if not first <= value <= last:
+            raise serializers.ValidationError(f"Date out of range; use {first.isoformat()} to {last.isoformat()}")
+        return value
+
+
+class ReportRangeSerializer(serializers.Serializer):
+    # optional range, widened to whole buckets of the mode; exposed as `from`/`to`
+    date_from = FlexibleDateField(required=False, source='date_from')
+    to = FlexibleDateField(required=False, source='date_to')
+    limit = serializers.IntegerField(required=False, min_value=1)  # keep only the latest N buckets
+
+    def get_fields(self):
+        fields = super().get_fields()
+        fields['from'] = fields.pop('date_from')  # `from` is a keyword, can't be declared directly
+        return fields
+
+    def validate(self, attrs):
+        if attrs.get('date_from') and attrs.get('date_to') and attrs['date_from'] > attrs['date_to']:
+            raise serializers.ValidationError("`from` must not be after `to`")
+        return attrs
+
+
+class ReportQuerySerializer(ReportRangeSerializer):
     type = serializers.ChoiceField(choices=['count', 'amount'])
     mode = serializers.ChoiceField(choices=['daily', 'weekly', 'monthly'])
     merchantId =ObjectIdField(required=False)
+    stream = serializers.BooleanField(required=False, default=False)  # chunked response straight from the cursor
+
+
+class ReportBatchQuerySerializer(ReportRangeSerializer):
+    types = serializers.ListField(child=serializers.ChoiceField(choices=['count', 'amount']), allow_empty=False)
+    modes = serializers.ListField(child=serializers.ChoiceField(choices=['daily', 'weekly', 'monthly']), allow_empty=False)
+    # omitted -> one global series set
+    merchantIds = serializers.ListField(child=ObjectIdField(), required=False, allow_empty=False,
+                                        max_length=settings.REPORT_BATCH_MAX_MERCHANTS)
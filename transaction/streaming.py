@@ -0,0 +1,52 @@
+import json
+from django.conf import settings
+from django.http import StreamingHttpResponse
+
+# Same output as DRF's JSONRenderer with its defaults (UNICODE_JSON, COMPACT_JSON)
+_encoder = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'))
+
+
+def iter_json_array(items, chunk_items: int):
+    """Encode an iterable as a JSON array, yielding bytes every `chunk_items` elements."""
+    buf = ['[']
+    n = 0
+    for item in items:
+        if n:
+            buf.append(',')
+        buf.append(_encoder.encode(item))
+        n += 1
+        if n % chunk_items == 0:
+            yield ''.join(buf).encode('utf-8')
+            buf = []
+    buf.append(']')
+    yield ''.join(buf).encode('utf-8')
+
+
+def report_json(labels, values) -> bytes:
+    """`[{"key": label, "value": value}, ...]` encoded exactly like the non-streaming report responses."""
+    return _encoder.encode([{'key': k, 'value': v} for k, v in zip(labels, values)]).encode('utf-8')
+
+
+class _StreamingResponse(StreamingHttpResponse):
+    """StreamingHttpResponse that runs `on_close` once the server is done with it."""
+    def __init__(self, *args, on_close=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._on_close = on_close
+
+    def close(self):
+        try:
+            super().close()
+        finally:
+            if self._on_close:
+                self._on_close()
+
+
+def streaming_json_response(items, status: int = 200, on_close=None) -> StreamingHttpResponse:
+    """
+    Stream `{"key", "value"}` items into the response as they are produced,
+    so memory stays flat however many buckets are returned. `on_close` runs
+    when the response is closed, e.g. to free resources held while streaming.
+    """
+    chunk_items = int(getattr(settings, "REPORT_STREAM_CHUNK_ITEMS", 500))
+    return _StreamingResponse(iter_json_array(items, chunk_items), status=status,
+                              content_type='application/json', on_close=on_close)
@@ -0,0 +1,544 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+from time import monotonic
+from django.conf import settings
+from django.utils import timezone
+from pymongo import UpdateOne, ReplaceOne
+from pymongo.errors import OperationFailure
+from mongo import get_collection
+from .report_cache import report_cache
+from .streaming import report_json
+from .helpers import (MODES, aggregate_daily_both, iter_daily_by_merchant, rollup_both, jalali_label,
+                      tehran_date, label_to_gregorian_date, tehran_midnight, created_at_span)
+
+STREAM_STATE_ID = 'stream:transaction'
+
+TTL_INDEX_NAME = "ttl_createdAt"
+UNIQ_INDEX_NAME = "u_mode_label_merchant"
+ORDER_INDEX_NAME = "mode_merchant_bucket_start"
+
+# Compact docs, one per (scope, mode), next to the per-bucket docs
+SERIES_COLLECTION = 'transaction_summary_series'
+
+
+def scope_key(merchant) -> str:
+    """Watermark key of a summary scope: the merchant id, or 'global'."""
+    return str(merchant) if merchant else 'global'
+
+
+def scope_match(merchant) -> dict:
+    """Filter selecting summary docs of one scope (global docs have no merchantId)."""
+    if merchant:
+        return {'merchantId': merchant}
+    return {'merchantId': {'$exists': False}}
+
+
+def bucket_update(mode: str, row: dict, merchant, now, inc: bool = False) -> UpdateOne:
+    """
+    Upsert for one summary bucket. With inc=True the counts are added to the
+    stored bucket instead of replacing it.
+    """
+    filt = {'mode': mode, 'label_jalali': row['label_jalali'], **scope_match(merchant)}
+    start = tehran_midnight(label_to_gregorian_date(mode, row['label_jalali']))
+    doc = {'mode': mode, 'label_jalali': row['label_jalali'], 'bucket_start': start, 'createdAt': now}
+    if merchant:
+        doc['merchantId'] = merchant
+
+    if inc:
+        update = {'$set': doc, '$inc': {'count': int(row['count']), 'amount': row['amount']}}
+    else:
+        update = {'$set': {**doc, 'count': int(row['count']), 'amount': row['amount']}}
+    if not merchant:
+        update['$unset'] = {'merchantId': ""}  # guarantee it’s absent on global docs
+    return UpdateOne(filt, update, upsert=True)
+
+
+def series_key(merchant, mode: str) -> str:
+    return f"{scope_key(merchant)}:{mode}"
+
+
+def series_collection(out):
+    return out.database[SERIES_COLLECTION]
+
+
+def series_update(mode: str, rows: list, merchant, now) -> ReplaceOne:
+    """
+    Compact summary of one (scope, mode): chronological parallel arrays of
+    labels, bucket starts, counts and amounts, plus the cached report's JSON
+    body for each metric, ready to be sent as is.
+    """
+    labels = [r['label_jalali'] for r in rows]
+    counts = [int(r['count']) for r in rows]
+    amounts = [r['amount'] for r in rows]
+    doc = {
+        'mode': mode,
+        'labels': labels,
+        'starts': [tehran_midnight(label_to_gregorian_date(mode, label)) for label in labels],
+        'counts': counts,
+        'amounts': amounts,
+        'json': {'count': report_json(labels, counts), 'amount': report_json(labels, amounts)},
+        'createdAt': now,
+    }
+    if merchant:
+        doc['merchantId'] = merchant
+    return ReplaceOne({'_id': series_key(merchant, mode)}, doc, upsert=True)
+
+
+def refresh_series(out, merchant, modes, now):
+    """Rewrite a scope's compact docs from its bucket docs, after they were changed with `$inc`."""
+    ops = []
+    for mode in modes:
+        rows = out.find({'mode': mode, **scope_match(merchant)},
+                        {'_id': 0, 'label_jalali': 1, 'count': 1, 'amount': 1}).sort('bucket_start', 1)
+        ops.append(series_update(mode, list(rows), merchant, now))
+    series_collection(out).bulk_write(ops, ordered=False)
+
+
+def operation_time(coll):
+    """
+    The deployment's latest operation time (a bson Timestamp; None on a
+    standalone server). Builds record the one taken before they read, so the
+    change stream can tell which inserts they already counted.
+    """
+    return coll.database.command('hello').get('operationTime')
+
+
+class SeriesRefresher:
+    """
+    Debounced refresh_series for a long-running caller: scopes changed with
+    `$inc` are marked with touch(), and flush() rewrites each marked scope at
+    most once per `interval` seconds, so a scope touched on every micro-batch
+    (the global one) isn't re-read and rewritten in full every time.
+    """
+
+    def __init__(self, out, interval: float):
+        self.out = out
+        self.interval = interval
+        self._dirty = {}  # scope key -> merchant
+        self._last = {}   # scope key -> monotonic() of its last rewrite
+
+    def touch(self, merchant):
+        self._dirty[scope_key(merchant)] = merchant
+
+    def flush(self, now=None, force: bool = False) -> int:
+        t = monotonic()
+        due = [k for k in self._dirty if force or t - self._last.get(k, t - self.interval) >= self.interval]
+        for key in due:
+            refresh_series(self.out, self._dirty.pop(key), MODES, now or timezone.now())
+            self._last[key] = t
+        return len(due)
+
+
+def latest_created_at(tx, match: dict):
+    """Newest `createdAt` among transactions matching `match`, or None."""
+    doc = tx.find_one(match, {'createdAt': 1}, sort=[('createdAt', -1)])
+    return doc['createdAt'] if doc else None
+
+
+def get_watermark(state, merchant):
+    doc = state.find_one({'_id': scope_key(merchant)})
+    return doc['watermark'] if doc else None
+
+
+def watermark_update(merchant, watermark, now, built_at=None, forward_only=False) -> UpdateOne:
+    # refreshedAt: when the scope was last brought up to date; createdAt: TTL clock;
+    # builtAt: operation time the build read at (inserts committed later weren't counted)
+    doc = {'refreshedAt': now, 'createdAt': now}
+    if built_at is not None:
+        doc['builtAt'] = built_at
+    if merchant:
+        doc['merchantId'] = merchant
+    update = {'$set': doc}
+    if forward_only:
+        # the change stream watcher may have moved it past this build's read already
+        update['$max'] = {'watermark': watermark}
+    else:
+        doc['watermark'] = watermark
+    return UpdateOne({'_id': scope_key(merchant)}, update, upsert=True)
+
+
+def set_watermark(state, merchant, watermark, now, built_at=None, forward_only=False):
+    state.bulk_write([watermark_update(merchant, watermark, now, built_at, forward_only)])
+
+
+def _age(doc, now):
+    if doc is None:
+        return None
+    refreshed = doc.get('refreshedAt') or doc['createdAt']
+    return ((now or timezone.now()) - refreshed).total_seconds()
+
+
+def summary_age(state, merchant, now=None):
+    """Seconds since the scope's summaries were last refreshed, or None when it has none."""
+    return _age(state.find_one({'_id': scope_key(merchant)}, {'refreshedAt': 1, 'createdAt': 1}), now)
+
+
+async def asummary_age(state, merchant, now=None):
+    return _age(await state.find_one({'_id': scope_key(merchant)}, {'refreshedAt': 1, 'createdAt': 1}), now)
+
+
+def is_stale(age) -> bool:
+    return age is not None and age > int(getattr(settings, "SUMMARY_TTL_SECONDS", 86400))
+
+
+def build_full(tx, out, state, merchant, modes, now=None) -> int:
+    """
+    Rebuild every bucket of `modes` for one scope from the raw collection.
+    The watermark is only saved when all modes were rebuilt, since the
+    incremental path advances all of them together.
+    """
+    now = now or timezone.now()
+    match = {'merchantId': merchant} if merchant else {}
+    op = operation_time(tx)
+    hi = latest_created_at(tx, match)
+    if hi is None:
+        return 0
+    match['createdAt'] = {'$lte': hi}
+
+    daily = aggregate_daily_both(tx, match)
+    rows = {mode: rollup_both(daily, mode) for mode in modes}
+    bulk = [bucket_update(mode, r, merchant, now) for mode in modes for r in rows[mode]]
+    if bulk:
+        out.bulk_write(bulk, ordered=False)
+    series_collection(out).bulk_write([series_update(mode, rows[mode], merchant, now) for mode in modes],
+                                      ordered=False)
+    if set(modes) == set(MODES):
+        set_watermark(state, merchant, hi, now, op)
+    report_cache.invalidate(merchant)
+    return len(bulk)
+
+
+def build_incremental(tx, out, state, merchant, now=None) -> int:
+    """
+    Aggregate only transactions newer than the scope's watermark and merge
+    them into the stored buckets of every mode with `$inc`. Falls back to a
+    full build when the scope has no watermark or its docs have expired.
+    A run with nothing new still marks the scope refreshed.
+    """
+    now = now or timezone.now()
+    wm = get_watermark(state, merchant)
+    if wm is None or out.find_one(scope_match(merchant), {'_id': 1}) is None:
+        return build_full(tx, out, state, merchant, MODES, now)
+
+    match = {'merchantId': merchant} if merchant else {}
+    op = operation_time(tx)
+    hi = latest_created_at(tx, match)
+    bulk = []
+    if hi is not None and hi > wm:
+        match['createdAt'] = {'$gt': wm, '$lte': hi}
+        daily = aggregate_daily_both(tx, match)
+        bulk = [bucket_update(mode, r, merchant, now, inc=True) for mode in MODES for r in rollup_both(daily, mode)]
+        if bulk:
+            out.bulk_write(bulk, ordered=False)
+    # keep untouched buckets of the scope on the same TTL clock as the watermark
+    out.update_many(scope_match(merchant), {'$set': {'createdAt': now}})
+    refresh_series(out, merchant, MODES, now)
+    set_watermark(state, merchant, max(hi, wm) if hi else wm, now, op, forward_only=True)
+    if bulk:
+        report_cache.invalidate(merchant)
+    return len(bulk)
+
+
+def build_all_merchants(tx, out, state, modes, now=None, hi=None, merchant_ids=None, op=None) -> int:
+    """
+    Rebuild every merchant scope from one (merchantId, day) aggregation.
+    Upserts are flushed in chunks of SUMMARY_BULK_BATCH_SIZE so memory stays
+    flat regardless of the number of merchants. `hi`, `op` and `merchant_ids`
+    let a parallel build give each worker its share under one common
+    watermark and build point.
+    """
+    now = now or timezone.now()
+    if hi is None:
+        op = operation_time(tx)
+        hi = latest_created_at(tx, {})
+    if hi is None:
+        return 0
+    match = {'createdAt': {'$lte': hi}}
+    if merchant_ids is not None:
+        match['merchantId'] = {'$in': merchant_ids}
+    batch_size = int(getattr(settings, "SUMMARY_BULK_BATCH_SIZE", 1000))
+    all_modes = set(modes) == set(MODES)
+
+    # series docs carry a scope's whole history, so they go out in much smaller chunks
+    series_batch_size = max(1, batch_size // 100)
+    series = series_collection(out)
+
+    total = 0
+    bulk, marks, compact = [], [], []
+    for merchant, daily in iter_daily_by_merchant(tx, match):
+        for mode in modes:
+            rows = rollup_both(daily, mode)
+            bulk.extend(bucket_update(mode, r, merchant, now) for r in rows)
+            compact.append(series_update(mode, rows, merchant, now))
+        if all_modes:
+            marks.append(watermark_update(merchant, hi, now, op))
+        if len(bulk) >= batch_size:
+            out.bulk_write(bulk, ordered=False)
+            total += len(bulk)
+            bulk = []
+        if len(marks) >= batch_size:
+            state.bulk_write(marks, ordered=False)
+            marks = []
+        if len(compact) >= series_batch_size:
+            series.bulk_write(compact, ordered=False)
+            compact = []
+
+    if bulk:
+        out.bulk_write(bulk, ordered=False)
+        total += len(bulk)
+    if compact:
+        series.bulk_write(compact, ordered=False)
+    if marks:
+        state.bulk_write(marks, ordered=False)
+    report_cache.invalidate(everything=True)
+    return total
+
+
+# Parallel rebuild: partitions run in a spawned process pool, each with its
+# own Mongo client. A single scope is split into contiguous Tehran-day ranges
+# whose daily rows are concatenated and rolled up once in the parent, so
+# weeks/months crossing a partition edge are summed correctly. All-merchants
+# builds are split into disjoint merchant sets written by the workers.
+
+def _init_worker():
+    import django
+    django.setup()
+
+
+def _pool(workers: int) -> ProcessPoolExecutor:
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                               initializer=_init_worker)
+
+
+def _partition_daily(match: dict) -> list:
+    return aggregate_daily_both(get_collection('transaction'), match)
+
+
+def _partition_merchants(merchant_ids: list, modes: list, hi, op, now) -> int:
+    tx, out, state = get_collections()
+    return build_all_merchants(tx, out, state, modes, now, hi=hi, merchant_ids=merchant_ids, op=op)
+
+
+def day_partitions(first, last, parts: int) -> list:
+    """Split the Gregorian days first..last into up to `parts` contiguous [start, end) day ranges."""
+    days = (last - first).days + 1
+    parts = max(1, min(parts, days))
+    step, extra = divmod(days, parts)
+    out, start = [], first
+    for i in range(parts):
+        end = start + timedelta(days=step + (1 if i < extra else 0))
+        out.append((start, end))
+        start = end
+    return out
+
+
+def build_full_parallel(tx, out, state, merchant, modes, workers: int, now=None) -> int:
+    """build_full with the daily aggregation split by date range across `workers` processes."""
+    now = now or timezone.now()
+    match = {'merchantId': merchant} if merchant else {}
+    op = operation_time(tx)
+    hi = latest_created_at(tx, match)
+    if hi is None:
+        return 0
+    span = created_at_span(tx, {**match, 'createdAt': {'$lte': hi}})
+    # a few partitions per worker evens out days that hold more data than others
+    ranges = day_partitions(tehran_date(span[0]), tehran_date(span[1]), workers * 4)
+    matches = [
+        {**match, 'createdAt': {'$gte': tehran_midnight(lo), '$lt': tehran_midnight(up), '$lte': hi}}
+        for lo, up in ranges
+    ]
+    with _pool(workers) as pool:
+        daily = [row for rows in pool.map(_partition_daily, matches) for row in rows]
+
+    batch_size = int(getattr(settings, "SUMMARY_BULK_BATCH_SIZE", 1000))
+    total = 0
+    for mode in modes:
+        rows = rollup_both(daily, mode)
+        bulk = [bucket_update(mode, r, merchant, now) for r in rows]
+        for i in range(0, len(bulk), batch_size):
+            out.bulk_write(bulk[i:i + batch_size], ordered=False)
+        series_collection(out).bulk_write([series_update(mode, rows, merchant, now)])
+        total += len(bulk)
+    if set(modes) == set(MODES):
+        set_watermark(state, merchant, hi, now, op)
+    report_cache.invalidate(merchant)
+    return total
+
+
+def build_all_merchants_parallel(tx, out, state, modes, workers: int, now=None) -> int:
+    """build_all_merchants with merchants split into disjoint sets across `workers` processes."""
+    now = now or timezone.now()
+    op = operation_time(tx)
+    hi = latest_created_at(tx, {})
+    if hi is None:
+        return 0
+    merchants = sorted(tx.distinct('merchantId', {'createdAt': {'$lte': hi}}))
+    parts = max(1, min(workers * 4, len(merchants)))
+    chunks = [merchants[i::parts] for i in range(parts)]
+    with _pool(workers) as pool:
+        futures = [pool.submit(_partition_merchants, chunk, modes, hi, op, now) for chunk in chunks if chunk]
+        total = sum(f.result() for f in futures)
+    report_cache.invalidate(everything=True)
+    return total
+
+
+def apply_inserts(out, state, changes, now=None, refreshed=None, series=None, resume_token=None) -> int:
+    """
+    Merge insert events of the `transaction` change stream into the stored
+    buckets with `$inc`, for the global scope and each document's merchant
+    scope.
+
+    Only scopes that were built before (have a watermark) are maintained. An
+    insert is skipped only when the scope's last build already counted it:
+    committed before the build's `builtAt` operation time with a `createdAt`
+    up to the watermark. So inserts that commit out of `createdAt` order are
+    still applied; one committing while a build reads may be counted twice.
+    Scopes built before `builtAt` was recorded fall back to comparing
+    `createdAt` with the watermark. Watermarks are advanced with `$max`.
+
+    With `resume_token` the bucket increments, the watermarks and the
+    stream's resume token are written in one transaction, so a watcher that
+    dies mid-batch resumes before the batch and none of it was counted.
+
+    `refreshed` maps scope key -> last time its untouched buckets had their
+    TTL clock bumped; a long-running caller passes the same dict every time
+    so each scope is refreshed about twice per retention period. It also
+    passes a SeriesRefresher as `series`, which then rewrites the touched
+    scopes' series docs on its own schedule instead of right away.
+    """
+    now = now or timezone.now()
+    merchants = {c['fullDocument'].get('merchantId') for c in changes} - {None}
+    keys = [scope_key(None)] + [scope_key(m) for m in merchants]
+    marks, built = {}, {}
+    for s in state.find({'_id': {'$in': keys}}, {'watermark': 1, 'builtAt': 1}):
+        marks[s['_id']] = s['watermark']
+        built[s['_id']] = s.get('builtAt')
+
+    deltas = {}   # (scope_key, mode, label) -> [count, amount]
+    latest = {}   # scope_key -> newest createdAt applied
+    scopes = {}   # scope_key -> merchant
+    for c in changes:
+        d = c['fullDocument']
+        created = d.get('createdAt')
+        if created is None:
+            continue
+        day = tehran_date(created)
+        for merchant in [None] + ([d['merchantId']] if d.get('merchantId') else []):
+            key = scope_key(merchant)
+            if key not in marks:
+                continue
+            if created <= marks[key] and (built[key] is None or c['clusterTime'] <= built[key]):
+                continue
+            scopes[key] = merchant
+            latest[key] = max(latest.get(key, created), created)
+            for mode in MODES:
+                acc = deltas.setdefault((key, mode, jalali_label(day, mode)), [0, 0])
+                acc[0] += 1
+                acc[1] += d.get('amount', 0)
+
+    bulk = [
+        bucket_update(mode, {'label_jalali': label, 'count': c, 'amount': a}, scopes[key], now, inc=True)
+        for (key, mode, label), (c, a) in deltas.items()
+    ]
+    state_ops = [
+        UpdateOne({'_id': key}, {'$max': {'watermark': wm}, '$set': {'refreshedAt': now, 'createdAt': now}})
+        for key, wm in latest.items()
+    ]
+    if resume_token is not None:
+        state_ops.append(UpdateOne({'_id': STREAM_STATE_ID},
+                                   {'$set': {'resumeToken': resume_token, 'updatedAt': now}}, upsert=True))
+
+    def write(session=None):
+        if bulk:
+            out.bulk_write(bulk, ordered=False, session=session)
+        if state_ops:
+            state.bulk_write(state_ops, ordered=False, session=session)
+
+    if resume_token is None:
+        write()
+    else:
+        with state.database.client.start_session() as session:
+            session.with_transaction(write)
+
+    for merchant in scopes.values():
+        if series is None:
+            refresh_series(out, merchant, MODES, now)
+        else:
+            series.touch(merchant)
+
+    if refreshed is not None:
+        half_ttl = int(getattr(settings, "SUMMARY_RETENTION_SECONDS", 7 * 86400)) / 2
+        for key, merchant in scopes.items():
+            last = refreshed.get(key)
+            if last is None or (now - last).total_seconds() >= half_ttl:
+                out.update_many(scope_match(merchant), {'$set': {'createdAt': now}})
+                refreshed[key] = now
+
+    for merchant in scopes.values():
+        report_cache.invalidate(merchant)
+    return len(bulk)
+
+
+def get_collections():
+    """
+    (transaction, transaction_summary, transaction_summary_state) with indexes
+    ensured, including the TTL index of the series collection (see series_collection).
+    """
+    tx = get_collection('transaction')
+    out = get_collection('transaction_summary')
+    state = get_collection('transaction_summary_state')
+    ensure_indexes(out)
+    ensure_ttl_index(state)
+    ensure_ttl_index(series_collection(out))
+    return tx, out, state
+
+
+def ensure_ttl_index(coll):
+    existing = {idx["name"]: idx for idx in coll.list_indexes()}
+    # documents are deleted after the retention; freshness (SUMMARY_TTL_SECONDS) is tracked by refreshedAt
+    ttl_seconds = int(getattr(settings, "SUMMARY_RETENTION_SECONDS", 7 * 86400))
+    if TTL_INDEX_NAME in existing:
+        current_ttl = existing[TTL_INDEX_NAME].get("expireAfterSeconds")
+        if current_ttl != ttl_seconds:
+            # Update TTL in place (preferred) or fall back to drop+recreate
+            try:
+                coll.database.command(
+                    "collMod",
+                    coll.name,
+                    index={"name": TTL_INDEX_NAME, "expireAfterSeconds": ttl_seconds},
+                )
+            except OperationFailure:
+                # Older server or mismatch: drop + recreate
+                coll.drop_index(TTL_INDEX_NAME)
+                coll.create_index(
+                    "createdAt",
+                    expireAfterSeconds=ttl_seconds,
+                    name=TTL_INDEX_NAME,
+                )
+    else:
+        coll.create_index(
+            "createdAt",
+            expireAfterSeconds=ttl_seconds,
+            name=TTL_INDEX_NAME,
+        )
+    return existing
+
+
+def ensure_indexes(out):
+    existing = ensure_ttl_index(out)
+
+    # Uniqueness per bucket: (mode, label_jalali, merchantId?)
+    if UNIQ_INDEX_NAME not in existing:
+        out.create_index(
+            [("mode", 1), ("label_jalali", 1), ("merchantId", 1)],
+            unique=True,
+            name=UNIQ_INDEX_NAME,
+        )
+
+    # Ordered range reads for the cached endpoint: (mode, merchantId?, bucket_start)
+    if ORDER_INDEX_NAME not in existing:
+        out.create_index(
+            [("mode", 1), ("merchantId", 1), ("bucket_start", 1)],
+            name=ORDER_INDEX_NAME,
+        )
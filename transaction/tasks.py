@@ -0,0 +1,94 @@
+from time import monotonic
+from bson import ObjectId
+from celery import shared_task
+from celery.exceptions import SoftTimeLimitExceeded
+from django.conf import settings
+from kombu.exceptions import OperationalError
+from redis.exceptions import RedisError
+
+from redis_client import get_redis
+from .access import hottest_scopes
+from .summary import scope_key, get_collections, build_incremental, summary_age
+
+
+def _rebuild_lock(merchant) -> str:
+    return f"summary:rebuild:{scope_key(merchant)}"
+
+
+def _lock_rebuild(merchant) -> bool:
+    ttl = int(getattr(settings, "SUMMARY_REBUILD_LOCK_SECONDS", 900))
+    return bool(get_redis().set(_rebuild_lock(merchant), 1, nx=True, ex=ttl))
+
+
+def request_rebuild(merchant) -> bool:
+    """
+    Queue one background rebuild of a summary scope. A Redis SET NX lock keeps
+    it to one pending or running rebuild per scope; it is released when the
+    task ends, or expires after SUMMARY_REBUILD_LOCK_SECONDS if a worker dies.
+    Never raises: a request path must not fail because Redis or the broker is down.
+    """
+    try:
+        if not _lock_rebuild(merchant):
+            return False
+    except RedisError:
+        return False
+    try:
+        # no publish retries: an unreachable broker must not hold up the response
+        rebuild_summary_task.apply_async(args=[str(merchant) if merchant else None], retry=False)
+    except OperationalError:
+        try:
+            get_redis().delete(_rebuild_lock(merchant))
+        except RedisError:
+            pass
+        return False
+    return True
+
+
+@shared_task(name="transaction.rebuild_summary", queue="summaries",
+             time_limit=settings.SUMMARY_REBUILD_TIME_LIMIT, soft_time_limit=settings.SUMMARY_REBUILD_TIME_LIMIT * 9 // 10)
+def rebuild_summary_task(merchant_id: str | None = None):
+    # incremental: only new transactions are aggregated; a scope without a watermark gets a full build
+    merchant = ObjectId(merchant_id) if merchant_id else None
+    try:
+        tx, out, state = get_collections()
+        return build_incremental(tx, out, state, merchant)
+    finally:
+        get_redis().delete(_rebuild_lock(merchant))
+
+
+# the budget only stops new rebuilds, so the limits leave room for the last one to finish
+@shared_task(name="transaction.prewarm_hot_summaries", queue="summaries",
+             time_limit=settings.SUMMARY_PREWARM_BUDGET_SECONDS + settings.SUMMARY_REBUILD_TIME_LIMIT,
+             soft_time_limit=settings.SUMMARY_PREWARM_BUDGET_SECONDS + settings.SUMMARY_REBUILD_TIME_LIMIT * 9 // 10)
+def prewarm_hot_summaries_task():
+    """
+    Keep the SUMMARY_PREWARM_TOP_N most requested scopes built and fresh, so
+    they stay on the cached path. Scopes are refreshed hottest first once
+    past half the freshness window; no new rebuild starts after
+    SUMMARY_PREWARM_BUDGET_SECONDS of Mongo work, the rest waits for the next run.
+    A run cut short by its soft time limit returns what it got done.
+    """
+    top_n = int(getattr(settings, "SUMMARY_PREWARM_TOP_N", 50))
+    budget = float(getattr(settings, "SUMMARY_PREWARM_BUDGET_SECONDS", 120))
+    refresh_after = int(getattr(settings, "SUMMARY_TTL_SECONDS", 86400)) / 2
+
+    tx, out, state = get_collections()
+    started = monotonic()
+    built, upserts = 0, 0
+    try:
+        for merchant in hottest_scopes(top_n):
+            if monotonic() - started >= budget:
+                break
+            age = summary_age(state, merchant)
+            if age is not None and age < refresh_after:
+                continue
+            if not _lock_rebuild(merchant):
+                continue  # a rebuild of this scope is already queued or running
+            try:
+                upserts += build_incremental(tx, out, state, merchant)
+                built += 1
+            finally:
+                get_redis().delete(_rebuild_lock(merchant))
+    except SoftTimeLimitExceeded:
+        pass
+    return {"scopes": built, "upserts": upserts, "seconds": round(monotonic() - started, 3)}
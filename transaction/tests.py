@@ -1,3 +1,439 @@
-from django.test import TestCase
+import random
+import threading
+import time
+from datetime import date, datetime, timedelta, timezone
+from unittest import mock
 
-# Create your tests here.
+import jdatetime
+from django.test import SimpleTestCase
+from redis.exceptions import RedisError
+from rest_framework.renderers import JSONRenderer
+
+from . import admission, helpers, report_cache as report_cache_module
+from .admission import AggregationGate, Overloaded
+from .report_cache import ReportCache
+from .helpers import (MODES, PERSIAN_MONTHS, jalali_label, label_to_gregorian_date, bucket_start, bucket_end,
+                      rollup_both, created_at_range, tehran_date, tehran_midnight, supported_dates)
+from .serializers import ReportQuerySerializer
+from .summary import day_partitions, series_update
+from .views import series_body, series_projection
+
+
+def _jdatetime_label(g: date, mode: str) -> str:
+    """Labels as they were formatted straight from jdatetime before the calendar index."""
+    jd = jdatetime.date.fromgregorian(date=g)
+    if mode == 'daily':
+        return f"{jd.year:04d}/{jd.month:02d}/{jd.day:02d}"
+    if mode == 'monthly':
+        return f"{jd.year} {PERSIAN_MONTHS[jd.month-1]}"
+    return f"هفته {jd.weeknumber()} سال {jd.year}"
+
+
+def _days(first: date, last: date):
+    d = first
+    while d <= last:
+        yield d
+        d += timedelta(days=1)
+
+
+class JalaliCalendarTests(SimpleTestCase):
+    FIRST, LAST = date(2005, 1, 1), date(2035, 12, 31)
+
+    def test_labels_match_jdatetime(self):
+        for g in _days(self.FIRST, self.LAST):
+            for mode in MODES:
+                self.assertEqual(jalali_label(g, mode), _jdatetime_label(g, mode), (g, mode))
+
+    def test_label_inverse(self):
+        for g in _days(self.FIRST, self.LAST):
+            jd = jdatetime.date.fromgregorian(date=g)
+            self.assertEqual(label_to_gregorian_date('daily', jalali_label(g, 'daily')), g)
+            self.assertEqual(label_to_gregorian_date('monthly', jalali_label(g, 'monthly')),
+                             jdatetime.date(jd.year, jd.month, 1).togregorian())
+            self.assertEqual(label_to_gregorian_date('weekly', jalali_label(g, 'weekly')), bucket_start(g, 'weekly'))
+
+    def test_bucket_bounds(self):
+        for g in _days(self.FIRST, self.LAST):
+            for mode in MODES:
+                lo, hi = bucket_start(g, mode), bucket_end(g, mode)
+                self.assertTrue(lo <= g < hi, (g, mode))
+                label = _jdatetime_label(g, mode)
+                self.assertEqual(_jdatetime_label(lo, mode), label)
+                self.assertEqual(_jdatetime_label(hi - timedelta(days=1), mode), label)
+                self.assertNotEqual(_jdatetime_label(lo - timedelta(days=1), mode), label)
+                self.assertNotEqual(_jdatetime_label(hi, mode), label)
+
+    def test_label_order_is_chronological(self):
+        for mode in MODES:
+            labels = []
+            for g in _days(self.FIRST, self.LAST):
+                label = jalali_label(g, mode)
+                if not labels or labels[-1] != label:
+                    labels.append(label)
+            starts = [label_to_gregorian_date(mode, label) for label in labels]
+            self.assertEqual(starts, sorted(starts), mode)
+            self.assertEqual(len(set(starts)), len(starts), mode)
+
+    def test_supported_range(self):
+        first, last = supported_dates()
+        with self.assertRaises(ValueError):
+            jalali_label(first - timedelta(days=1), 'daily')
+        with self.assertRaises(ValueError):
+            label_to_gregorian_date('monthly', f"{helpers.CALENDAR_LIMITS[1] + 1} فروردین")
+        for value in ['0001/01/01', '9999-12-31', (first - timedelta(days=1)).isoformat(),
+                      (last + timedelta(days=1)).isoformat()]:
+            ser = ReportQuerySerializer(data={'type': 'count', 'mode': 'daily', 'from': value})
+            self.assertFalse(ser.is_valid(), value)
+            self.assertIn('from', ser.errors)
+        ser = ReportQuerySerializer(data={'type': 'count', 'mode': 'daily', 'from': '1330/01/01', 'to': last.isoformat()})
+        self.assertTrue(ser.is_valid(), ser.errors)
+        self.assertEqual(ser.validated_data['date_from'], first)
+
+
+def _reference_rollup(daily_rows, mode: str):
+    """Label-keyed rollup as it was before the calendar index and the NumPy path."""
+    buckets = {}
+    for g, c, a in daily_rows:
+        acc = buckets.setdefault(_jdatetime_label(g, mode), [0, 0])
+        acc[0] += c
+        acc[1] += a
+    ordered = sorted(buckets.items(), key=lambda kv: label_to_gregorian_date(mode, kv[0]))
+    return [{'label_jalali': label, 'count': c, 'amount': a} for label, (c, a) in ordered]
+
+
+class RollupTests(SimpleTestCase):
+    def setUp(self):
+        rnd = random.Random(16)
+        days = sorted(rnd.sample(range(date(2015, 1, 1).toordinal(), date(2030, 1, 1).toordinal()), 2000))
+        self.rows = [(date.fromordinal(o), rnd.randint(1, 50), rnd.randint(1, 10 ** 9) * 10) for o in days]
+
+    def test_numpy_matches_python(self):
+        self.assertGreaterEqual(len(self.rows), helpers.ROLLUP_NUMPY_MIN_ROWS)
+        for mode in ['weekly', 'monthly']:
+            with mock.patch.object(helpers, 'ROLLUP_NUMPY_MIN_ROWS', len(self.rows) + 1):
+                python = rollup_both(self.rows, mode)
+            with mock.patch.object(helpers, '_rollup_numpy', wraps=helpers._rollup_numpy) as vectorized:
+                numpy = rollup_both(self.rows, mode)
+                vectorized.assert_called_once()
+            self.assertEqual(numpy, python, mode)
+            self.assertEqual([type(r['count']) for r in numpy], [int] * len(numpy))
+            self.assertEqual([type(r['amount']) for r in numpy], [int] * len(numpy))
+
+    def test_matches_reference(self):
+        for mode in MODES:
+            self.assertEqual(rollup_both(self.rows, mode), _reference_rollup(self.rows, mode), mode)
+            self.assertEqual(rollup_both(self.rows[:10], mode), _reference_rollup(self.rows[:10], mode), mode)
+
+    def test_int64_overflow_takes_python_path(self):
+        # every amount fits int64, their sum doesn't
+        rows = [(g, c, 2 ** 62 + a) for g, c, a in self.rows]
+        with mock.patch.object(helpers, '_rollup_numpy') as vectorized:
+            out = rollup_both(rows, 'monthly')
+            vectorized.assert_not_called()
+        self.assertEqual(out, _reference_rollup(rows, 'monthly'))
+        self.assertGreater(max(r['amount'] for r in out), 2 ** 63)
+
+    def test_float_amounts_take_python_path(self):
+        rows = [(g, c, a / 7) for g, c, a in self.rows]
+        with mock.patch.object(helpers, '_rollup_numpy') as vectorized:
+            out = rollup_both(rows, 'monthly')
+            vectorized.assert_not_called()
+        self.assertEqual(out, _reference_rollup(rows, 'monthly'))
+
+
+class DayPartitionTests(SimpleTestCase):
+    def test_contiguous_and_even(self):
+        first = date(2023, 3, 1)
+        for days in [1, 2, 7, 30, 365, 1000]:
+            last = first + timedelta(days=days - 1)
+            for parts in [1, 3, 8, 16, 2000]:
+                ranges = day_partitions(first, last, parts)
+                self.assertEqual(len(ranges), min(parts, days))
+                self.assertEqual(ranges[0][0], first)
+                self.assertEqual(ranges[-1][1], last + timedelta(days=1))
+                for (_, end), (start, _) in zip(ranges, ranges[1:]):
+                    self.assertEqual(end, start)
+                sizes = [(end - start).days for start, end in ranges]
+                self.assertTrue(min(sizes) >= 1 and max(sizes) - min(sizes) <= 1, (days, parts, sizes))
+
+    def test_at_least_one_part(self):
+        self.assertEqual(day_partitions(date(2024, 1, 1), date(2024, 1, 5), 0),
+                         [(date(2024, 1, 1), date(2024, 1, 6))])
+
+
+class CreatedAtRangeTests(SimpleTestCase):
+    def test_open_range(self):
+        for mode in MODES:
+            self.assertEqual(created_at_range(mode), {})
+
+    def test_whole_buckets(self):
+        rnd = random.Random(4)
+        base = datetime(2024, 1, 1, tzinfo=timezone.utc)
+        # every 97 minutes over a year, so bucket edges around Tehran midnight are hit
+        instants = [base + timedelta(minutes=97 * i) for i in range(366 * 24 * 60 // 97)]
+        days = {t: tehran_date(t) for t in instants}
+        for mode in MODES:
+            for _ in range(8):
+                date_from = date(2024, 1, 1) + timedelta(days=rnd.randrange(300))
+                date_to = date_from + timedelta(days=rnd.randrange(60))
+                for lo, hi in [(date_from, date_to), (date_from, None), (None, date_to)]:
+                    rng = created_at_range(mode, lo, hi)['createdAt']
+                    got = [t for t in instants
+                           if ('$gte' not in rng or t >= rng['$gte']) and ('$lt' not in rng or t < rng['$lt'])]
+                    labels = {jalali_label(d, mode) for d in (lo, hi) if d}
+                    want = [t for t, d in days.items()
+                            if (lo is None or d >= lo or jalali_label(d, mode) in labels)
+                            and (hi is None or d <= hi or jalali_label(d, mode) in labels)]
+                    self.assertEqual(got, want, (mode, lo, hi))
+                    if lo:
+                        self.assertEqual(rng['$gte'], tehran_midnight(bucket_start(lo, mode)))
+
+
+class SeriesBodyTests(SimpleTestCase):
+    def setUp(self):
+        rnd = random.Random(21)
+        days = sorted(rnd.sample(range(date(2023, 1, 1).toordinal(), date(2025, 1, 1).toordinal()), 400))
+        self.daily = [(date.fromordinal(o), rnd.randint(1, 50), rnd.randint(1, 10 ** 6)) for o in days]
+
+    def _expected(self, rows, qd, metric):
+        """What the per-bucket docs path returns: buckets from from's through to's, the last `limit` of them."""
+        mode = qd['mode']
+        lo = bucket_start(qd['date_from'], mode) if qd.get('date_from') else None
+        hi = bucket_start(qd['date_to'], mode) if qd.get('date_to') else None
+        picked = [r for r in rows
+                  if (lo is None or label_to_gregorian_date(mode, r['label_jalali']) >= lo)
+                  and (hi is None or label_to_gregorian_date(mode, r['label_jalali']) <= hi)]
+        if qd.get('limit'):
+            picked = picked[-qd['limit']:]
+        return JSONRenderer().render([{'key': r['label_jalali'], 'value': r[metric]} for r in picked])
+
+    def _read(self, doc, qd, metric):
+        """series_body() of the doc as the view reads it, through series_projection()."""
+        projected = {}
+        for field in series_projection(qd, metric):
+            top, _, sub = field.partition('.')
+            projected[top] = {sub: doc[top][sub]} if sub else doc[top]
+        return series_body(projected, qd, metric)
+
+    def test_matches_bucket_docs(self):
+        rnd = random.Random(5)
+        for mode in MODES:
+            rows = rollup_both(self.daily, mode)
+            doc = series_update(mode, rows, None, datetime.now(timezone.utc))._doc
+            for metric in ['count', 'amount']:
+                self.assertEqual(self._read(doc, {'mode': mode}, metric),
+                                 self._expected(rows, {'mode': mode}, metric))
+                for _ in range(30):
+                    date_from = date(2022, 12, 1) + timedelta(days=rnd.randrange(800))
+                    qd = {'mode': mode, 'date_from': rnd.choice([None, date_from]),
+                          'date_to': rnd.choice([None, date_from + timedelta(days=rnd.randrange(120))]),
+                          'limit': rnd.choice([None, 1, 5, 1000])}
+                    self.assertEqual(self._read(doc, qd, metric), self._expected(rows, qd, metric), qd)
+
+
+class _FakeRedis:
+    """The few hash and sorted-set commands the report cache and the admission gate use."""
+
+    def __init__(self):
+        self.hashes, self.zsets = {}, {}
+
+    def hmget(self, key, *fields):
+        return [self.hashes.get(key, {}).get(f) for f in fields]
+
+    def hincrby(self, key, field, amount=1):
+        h = self.hashes.setdefault(key, {})
+        h[field] = int(h.get(field, 0)) + amount
+        return h[field]
+
+    def zrem(self, key, member):
+        return int(self.zsets.get(key, {}).pop(member, None) is not None)
+
+    def pipeline(self):
+        return _FakePipeline(self)
+
+
+class _FakePipeline:
+    def __init__(self, redis):
+        self.redis, self.calls = redis, []
+
+    def zremrangebyscore(self, key, lo, hi):
+        def trim(z):
+            stale = [m for m, score in z.items() if score <= hi]
+            for m in stale:
+                del z[m]
+            return len(stale)
+        self.calls.append(trim)
+
+    def zadd(self, key, mapping):
+        self.calls.append(lambda z: z.update(mapping))
+
+    def zrank(self, key, member):
+        self.calls.append(lambda z: sorted(z, key=lambda m: (z[m], m)).index(member) if member in z else None)
+
+    def expire(self, key, seconds):
+        self.calls.append(lambda z: True)
+
+    def execute(self):
+        z = self.redis.zsets.setdefault(admission._GLOBAL_KEY, {})
+        return [call(z) for call in self.calls]
+
+
+class _BrokenRedis:
+    def __getattr__(self, name):
+        def fail(*args, **kwargs):
+            raise RedisError("unreachable")
+        return fail
+
+
+def _in_threads(n, target):
+    """Start target() in n threads; (threads, results, errors), filled in thread order as they finish."""
+    results, errors = [None] * n, [None] * n
+
+    def run(i):
+        try:
+            results[i] = target()
+        except Exception as e:
+            errors[i] = e
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(n)]
+    for t in threads:
+        t.start()
+    return threads, results, errors
+
+
+class ReportCacheTests(SimpleTestCase):
+    KEY = ('m1', 'daily', None, None)
+
+    def setUp(self):
+        self.redis = _FakeRedis()
+        patcher = mock.patch.object(report_cache_module, 'get_redis', lambda: self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _cache(self):
+        return ReportCache(max_entries=8, ttl_seconds=60, generation_check_seconds=0)
+
+    def _slow(self, release, outcome):
+        calls = []
+
+        def compute():
+            calls.append(1)
+            release.wait(5)
+            if isinstance(outcome, Exception):
+                raise outcome
+            return outcome
+        return compute, calls
+
+    def test_waiters_share_one_computation(self):
+        cache, release, rows = self._cache(), threading.Event(), [{'count': 1}]
+        compute, calls = self._slow(release, rows)
+        threads, results, errors = _in_threads(6, lambda: cache.get_or_compute(self.KEY, compute))
+        while not cache._inflight:
+            time.sleep(0.001)
+        time.sleep(0.05)  # let the other threads reach the wait
+        release.set()
+        for t in threads:
+            t.join()
+        self.assertEqual(calls, [1])
+        self.assertEqual(errors, [None] * 6)
+        self.assertTrue(all(r is rows for r in results))
+        self.assertIs(cache.get_or_compute(self.KEY, lambda: self.fail('cached')), rows)
+
+    def test_waiters_share_the_error(self):
+        cache, release, error = self._cache(), threading.Event(), ValueError("aggregation failed")
+        compute, calls = self._slow(release, error)
+        threads, results, errors = _in_threads(4, lambda: cache.get_or_compute(self.KEY, compute))
+        while not cache._inflight:
+            time.sleep(0.001)
+        time.sleep(0.05)
+        release.set()
+        for t in threads:
+            t.join()
+        self.assertEqual(calls, [1])
+        self.assertTrue(all(e is error for e in errors))
+        # errors are not cached
+        self.assertEqual(cache.get_or_compute(self.KEY, lambda: ['again']), ['again'])
+
+    def test_invalidation_reaches_other_caches(self):
+        here, there = self._cache(), self._cache()
+        other = ('m2', 'daily', None, None)
+        here.get_or_compute(self.KEY, lambda: ['m1 v1'])
+        here.get_or_compute(other, lambda: ['m2 v1'])
+        there.invalidate('m1')
+        self.assertEqual(here.get_or_compute(self.KEY, lambda: ['m1 v2']), ['m1 v2'])
+        self.assertEqual(here.get_or_compute(other, lambda: ['m2 v2']), ['m2 v1'])
+        there.invalidate(everything=True)
+        self.assertEqual(here.get_or_compute(other, lambda: ['m2 v3']), ['m2 v3'])
+
+    def test_generation_read_is_memoized(self):
+        here = ReportCache(max_entries=8, ttl_seconds=60, generation_check_seconds=60)
+        here.get_or_compute(self.KEY, lambda: ['v1'])
+        self._cache().invalidate('m1')
+        self.assertEqual(here.get_or_compute(self.KEY, lambda: ['v2']), ['v1'])
+
+    def test_serves_without_redis(self):
+        self.redis = _BrokenRedis()
+        cache = self._cache()
+        self.assertEqual(cache.get_or_compute(self.KEY, lambda: ['v1']), ['v1'])
+        cache.invalidate('m2')
+        self.assertEqual(cache.get_or_compute(self.KEY, lambda: ['v2']), ['v1'])
+        cache.invalidate('m1')
+        self.assertEqual(cache.get_or_compute(self.KEY, lambda: ['v2']), ['v2'])
+
+
+class AggregationGateTests(SimpleTestCase):
+    def setUp(self):
+        self.redis = _FakeRedis()
+        patcher = mock.patch.object(admission, 'get_redis', lambda: self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_overloaded_after_wait(self):
+        gate = AggregationGate(limit=1, global_limit=0, wait_ms=50, stale_after=60)
+        release = gate.acquire()
+        started = time.monotonic()
+        with self.assertRaises(Overloaded):
+            gate.acquire()
+        self.assertGreaterEqual(time.monotonic() - started, 0.045)
+        release()
+        gate.acquire()()
+
+    def test_release_is_idempotent(self):
+        gate = AggregationGate(limit=1, global_limit=1, wait_ms=20, stale_after=60)
+        release = gate.acquire()
+        release()
+        release()  # must not free a slot somebody else holds
+        held = gate.acquire()
+        with self.assertRaises(Overloaded):
+            gate.acquire()
+        held()
+        self.assertEqual(self.redis.zsets[admission._GLOBAL_KEY], {})
+
+    def test_global_limit_across_gates(self):
+        here = AggregationGate(limit=2, global_limit=2, wait_ms=20, stale_after=60)
+        there = AggregationGate(limit=2, global_limit=2, wait_ms=20, stale_after=60)
+        held = [here.acquire(), there.acquire()]
+        with self.assertRaises(Overloaded):
+            there.acquire()
+        # a failed attempt neither keeps a global entry nor a local slot
+        self.assertEqual(len(self.redis.zsets[admission._GLOBAL_KEY]), 2)
+        held.pop()()
+        there.run(lambda: None)
+        with there.slot():
+            with self.assertRaises(Overloaded):
+                here.acquire()
+        held.pop()()
+
+    def test_stale_holders_stop_counting(self):
+        gate = AggregationGate(limit=2, global_limit=1, wait_ms=20, stale_after=60)
+        self.redis.zsets[admission._GLOBAL_KEY] = {'crashed': time.time() - 61}
+        gate.acquire()()
+
+    def test_local_limit_without_redis(self):
+        self.redis = _BrokenRedis()
+        gate = AggregationGate(limit=1, global_limit=1, wait_ms=20, stale_after=60)
+        release = gate.acquire()
+        with self.assertRaises(Overloaded):
+            gate.acquire()
+        release()
+        self.assertEqual(gate.run(lambda: 'ran'), 'ran')
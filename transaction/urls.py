@@ -1,7 +1,18 @@
 from django.urls import path
-from .views import TransactionReportView, TransactionReportCachedView
+from .views import (TransactionReportView, TransactionReportCachedView, TransactionReportHybridView,
+                    TransactionReportBatchView)
+from .async_views import TransactionReportAsyncView, TransactionReportCachedAsyncView
 
 urlpatterns = [
     path('transactions/report/', TransactionReportView.as_view(), name='transactions-report'),
+    path('transactions/report/batch/', TransactionReportBatchView.as_view(), name='transactions-report-batch'),
     path('transactions/report/cached/', TransactionReportCachedView.as_view(), name='transactions-report-cached'),
+    path('transactions/report/hybrid/', TransactionReportHybridView.as_view(), name='transactions-report-hybrid'),
+]
+
+# async variants, only mounted by config.asgi_urls: under WSGI every call would get a new event loop
+# and with it a new AsyncMongoClient and pool
+async_urlpatterns = [
+    path('transactions/report/async/', TransactionReportAsyncView.as_view(), name='transactions-report-async'),
+    path('transactions/report/cached/async/', TransactionReportCachedAsyncView.as_view(), name='transactions-report-cached-async'),
 ]
@@ -1,9 +1,100 @@
+from bisect import bisect_left, bisect_right
+from itertools import chain
+from django.http import HttpResponse
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
+from pymongo.errors import ExecutionTimeout
 from mongo import get_collection
-from .serializers import ReportQuerySerializer
-from .helpers import aggregate_daily_both, rollup_both, label_to_gregorian_date
+from .serializers import ReportQuerySerializer, ReportBatchQuerySerializer
+from .report_cache import report_cache
+from .streaming import streaming_json_response, report_json
+from .summary import SERIES_COLLECTION, series_key, get_watermark, summary_age, is_stale
+from .tasks import request_rebuild
+from .access import record_access
+from .admission import Overloaded, aggregation_gate, max_time_ms
+from .helpers import (aggregate_buckets_both, aggregate_daily_both, iter_daily_both, iter_rollup_daily,
+                      rollup_both, clip_daily, coarsest_mode,
+                      bucket_start, created_at_range, tehran_date, tehran_midnight)
+
+
+def report_match(qd) -> dict:
+    """Raw-collection $match for a validated report query: merchant scope plus the aligned createdAt range."""
+    match = {}
+    if qd.get('merchantId'):
+        match['merchantId'] = qd['merchantId']
+    match.update(created_at_range(qd['mode'], qd.get('date_from'), qd.get('date_to')))
+    return match
+
+
+def summary_filter(qd) -> dict:
+    """`transaction_summary` filter for a validated report query."""
+    mode = qd['mode']
+    filt = {'mode': mode}
+    if qd.get('merchantId'):
+        filt['merchantId'] = qd['merchantId']
+    else:
+        # global docs omit merchantId field entirely
+        filt['merchantId'] = {'$exists': False}
+
+    date_from, date_to = qd.get('date_from'), qd.get('date_to')
+    rng = {}
+    if date_from:
+        rng['$gte'] = tehran_midnight(bucket_start(date_from, mode))
+    if date_to:
+        rng['$lte'] = tehran_midnight(bucket_start(date_to, mode))
+    if rng:
+        filt['bucket_start'] = rng
+    return filt
+
+
+def summary_docs(filt: dict, metric: str, limit: int | None = None):
+    """
+    `transaction_summary` docs (`label_jalali` + metric) matching `filt`, in
+    chronological order from the (mode, merchantId, bucket_start) index; with
+    a limit, read newest-first and flip so only the last N buckets are fetched.
+    """
+    # If collection doesn't exist yet, this just returns an empty cursor—safe.
+    coll = get_collection('transaction_summary', route='reports')
+    proj = {'_id': 0, 'label_jalali': 1, metric: 1}
+    if limit:
+        return list(coll.find(filt, proj).sort('bucket_start', -1).limit(limit))[::-1]
+    return coll.find(filt, proj).sort('bucket_start', 1)
+
+
+def series_projection(qd, metric: str) -> dict:
+    """What series_body() needs from a series doc: only the stored JSON for a whole-history query."""
+    if qd.get('date_from') or qd.get('date_to') or qd.get('limit'):
+        return {'labels': 1, 'starts': 1, metric + 's': 1}
+    return {f'json.{metric}': 1}
+
+
+def series_body(doc: dict, qd, metric: str) -> bytes:
+    """Report JSON from a compact series doc: stored bytes as is, or the from/to/limit slice of its arrays."""
+    if 'json' in doc:
+        return doc['json'][metric]
+    mode, date_from, date_to, limit = qd['mode'], qd.get('date_from'), qd.get('date_to'), qd.get('limit')
+    starts = doc['starts']
+    lo = bisect_left(starts, tehran_midnight(bucket_start(date_from, mode))) if date_from else 0
+    hi = bisect_right(starts, tehran_midnight(bucket_start(date_to, mode))) if date_to else len(starts)
+    if limit:
+        lo = max(lo, hi - limit)
+    return report_json(doc['labels'][lo:hi], doc[metric + 's'][lo:hi])
+
+
+def degraded_response(qd, metric: str):
+    """
+    Answer for a raw aggregation that was not admitted or ran out of its time
+    budget: the scope's stored summaries (`X-Report-Degraded: summary`) when
+    it has any, else 503.
+    """
+    state = get_collection('transaction_summary_state', route='reports')
+    if summary_age(state, qd.get('merchantId')) is None:
+        return Response({'detail': 'Report capacity exhausted, retry shortly'},
+                        status=status.HTTP_503_SERVICE_UNAVAILABLE, headers={'Retry-After': '1'})
+    docs = summary_docs(summary_filter(qd), metric, qd.get('limit'))
+    data = [{'key': d['label_jalali'], 'value': d.get(metric, 0)} for d in docs]
+    return Response(data, status=200, headers={'X-Report-Degraded': 'summary'})
 
 
 class TransactionReportView(APIView):
@@ -15,22 +106,60 @@ class TransactionReportView(APIView):
         metric = qd['type'] 
         mode = qd['mode']
         merchant_id = qd.get('merchantId')
+        record_access([merchant_id])
 
-        coll = get_collection('transaction')
+        coll = get_collection('transaction', route='reports')
 
-        match = {}
-        if merchant_id:
-            match['merchantId'] = merchant_id
+        match = report_match(qd)
+        budget = max_time_ms(mode)
 
-        daily = aggregate_daily_both(coll, match)
-        rows = rollup_both(daily, mode)  
+        # raw aggregations run in a limited number of slots with a per-mode maxTimeMS;
+        # when none frees up in time (or the budget runs out) serve summaries or 503
+        try:
+            if qd['stream'] and mode == 'daily' and not qd.get('limit'):
+                # straight off the cursor, bypassing the cache, so memory doesn't grow with history;
+                # the slot is held until the response is closed
+                release = aggregation_gate.acquire()
+                try:
+                    # pull the first batch now: the $group finishes all its work before returning it,
+                    # so a blown budget is answered as degraded here, not as a truncated 200
+                    days = iter_daily_both(coll, match, budget)
+                    first = next(days, None)
+                except BaseException:
+                    release()
+                    raise
+                rows = iter_rollup_daily(chain([first], days) if first is not None else days)
+                return streaming_json_response(({'key': r['label_jalali'], 'value': r[metric]} for r in rows),
+                                               on_close=release)
 
+            # weekly/monthly are bucketed server-side; daily rows come straight from the day grouping.
+            # Rows hold both metrics, so a `count` request also serves the matching `amount` one.
+            key = (merchant_id, mode, qd.get('date_from'), qd.get('date_to'))
+            rows = report_cache.get_or_compute(
+                key, lambda: aggregation_gate.run(lambda: aggregate_buckets_both(coll, match, mode, budget)))
+        except (Overloaded, ExecutionTimeout):
+            return degraded_response(qd, metric)
+        if qd.get('limit'):
+            rows = rows[-qd['limit']:]
+
+        if qd['stream']:
+            return streaming_json_response({'key': r['label_jalali'], 'value': r[metric]} for r in rows)
         data = [{'key': r['label_jalali'], 'value': r[metric]} for r in rows]
         return Response(data, status=200)
     
 
 
 class TransactionReportCachedView(APIView):
+    """
+    Answers with one point read of the scope's compact doc in
+    `transaction_summary_series`, falling back to the per-bucket docs of
+    `transaction_summary` for scopes built before those existed.
+
+    Summaries older than SUMMARY_TTL_SECONDS are still served, with
+    `X-Summary-Stale: <age in seconds>`, and one background rebuild of the
+    scope is queued. A scope with no summary at all (never built, or past
+    retention) is answered live while it is being built.
+    """
     def get(self, request):
         q = ReportQuerySerializer(data=request.data)
         if not q.is_valid():
@@ -39,21 +168,141 @@ class TransactionReportCachedView(APIView):
         type = qd['type']  
         mode = qd['mode']
         merchant_id = qd.get('merchantId')
+        record_access([merchant_id])
 
-        coll = get_collection('transaction_summary')
+        state = get_collection('transaction_summary_state', route='reports')
+        age = summary_age(state, merchant_id)
+        if age is None or is_stale(age):
+            request_rebuild(merchant_id)
+        if age is None:
+            try:
+                rows = hybrid_rows(qd, type)
+            except (Overloaded, ExecutionTimeout):
+                return degraded_response(qd, type)
+            if qd['stream']:
+                return streaming_json_response({'key': r['label_jalali'], 'value': r[type]} for r in rows)
+            return Response([{'key': r['label_jalali'], 'value': r[type]} for r in rows], status=200)
 
-        filt = {'mode': mode}
-        if merchant_id:
-            filt['merchantId'] = merchant_id
+        series = get_collection(SERIES_COLLECTION, route='reports')
+        doc = series.find_one({'_id': series_key(merchant_id, mode)}, series_projection(qd, type))
+        if doc is not None:
+            # the body is ready-made; `stream` has nothing left to save here
+            response = HttpResponse(series_body(doc, qd, type), content_type='application/json')
         else:
-            # global docs omit merchantId field entirely
-            filt['merchantId'] = {'$exists': False}
+            docs = summary_docs(summary_filter(qd), type, qd.get('limit'))
+            if qd['stream']:
+                response = streaming_json_response({'key': d['label_jalali'], 'value': d.get(type, 0)} for d in docs)
+            else:
+                data = [{'key': d['label_jalali'], 'value': d.get(type, 0)} for d in docs]
+                response = Response(data, status=200)
+        if is_stale(age):
+            response['X-Summary-Stale'] = str(int(age))
+        return response
+
+
+def hybrid_rows(qd, metric: str) -> list:
+    """
+    Report rows (`label_jalali` + `metric`) with closed buckets read from
+    `transaction_summary` and the open ones aggregated live.
+
+    Summaries hold every transaction up to the scope's watermark, so buckets
+    starting before the watermark's bucket are complete there; that bucket and
+    later ones are aggregated from the raw collection with a `createdAt` lower
+    bound. Watermark and summary docs are read on the same route, so a lagging
+    secondary only moves the boundary back. The live tail reads from the
+    primary. Without a watermark the whole range is aggregated live. Live
+    parts go through the aggregation gate (may raise Overloaded).
+    """
+    mode = qd['mode']
+    limit = qd.get('limit')
+    state = get_collection('transaction_summary_state', route='reports')
+    wm = get_watermark(state, qd.get('merchantId'))
+
+    def aggregate_live(match):
+        coll = get_collection('transaction')
+        return aggregation_gate.run(lambda: aggregate_buckets_both(coll, match, mode, max_time_ms(mode)))
+
+    match = report_match(qd)
+    if wm is None:
+        live = aggregate_live(match)
+        return live[-limit:] if limit else live
+
+    boundary = tehran_midnight(bucket_start(tehran_date(wm), mode))
+    rng = match.setdefault('createdAt', {})
+    live = []
+    if '$lt' not in rng or rng['$lt'] > boundary:
+        rng['$gte'] = max(rng.get('$gte', boundary), boundary)
+        live = aggregate_live(match)
+    if limit and len(live) >= limit:
+        return live[-limit:]
+
+    filt = summary_filter(qd)
+    filt.setdefault('bucket_start', {})['$lt'] = boundary
+    closed = summary_docs(filt, metric, limit - len(live) if limit else None)
+    return [{'label_jalali': d['label_jalali'], metric: d.get(metric, 0)} for d in closed] + live
+
+
+class TransactionReportHybridView(APIView):
+    """Exact report at close to cached latency: summaries for closed buckets, the open ones live."""
+    def get(self, request):
+        q = ReportQuerySerializer(data=request.data)
+        if not q.is_valid():
+            return Response(q.errors, status=status.HTTP_400_BAD_REQUEST)
+        qd = q.validated_data
+        metric = qd['type']
+        record_access([qd.get('merchantId')])
+
+        try:
+            rows = hybrid_rows(qd, metric)
+        except (Overloaded, ExecutionTimeout):
+            return degraded_response(qd, metric)
+        if qd['stream']:
+            return streaming_json_response({'key': r['label_jalali'], 'value': r[metric]} for r in rows)
+        data = [{'key': r['label_jalali'], 'value': r[metric]} for r in rows]
+        return Response(data, status=200)
+
+
+class TransactionReportBatchView(APIView):
+    """
+    Several modes and both metrics for one or more merchants in one call.
+    Each merchant is aggregated once per day over the range of the coarsest
+    requested mode; every series is rolled up from those same daily rows.
+    """
+    def get(self, request):
+        q = ReportBatchQuerySerializer(data=request.data)
+        if not q.is_valid():
+            return Response(q.errors, status=status.HTTP_400_BAD_REQUEST)
+        qd = q.validated_data
+        modes = list(dict.fromkeys(qd['modes']))
+        types = list(dict.fromkeys(qd['types']))
+        date_from, date_to = qd.get('date_from'), qd.get('date_to')
+        limit = qd.get('limit')
+        merchants = list(dict.fromkeys(qd.get('merchantIds') or [None]))
+        record_access(merchants)
+
+        coll = get_collection('transaction', route='reports')
+        range_match = created_at_range(coarsest_mode(modes), date_from, date_to)
+        budget = max_time_ms(coarsest_mode(modes))
 
-        # If collection doesn't exist yet, this just returns an empty cursor—safe.
-        docs = list(coll.find(filt, {'_id': 0, 'label_jalali': 1, type: 1}))
+        results = []
+        for merchant_id in merchants:
+            match = dict(range_match)
+            if merchant_id:
+                match['merchantId'] = merchant_id
+            key = (merchant_id, 'days', match.get('createdAt', {}).get('$gte'), match.get('createdAt', {}).get('$lt'))
+            try:
+                daily = report_cache.get_or_compute(
+                    key, lambda: aggregation_gate.run(lambda: aggregate_daily_both(coll, match, budget)))
+            except (Overloaded, ExecutionTimeout):
+                return Response({'detail': 'Report capacity exhausted, retry shortly'},
+                                status=status.HTTP_503_SERVICE_UNAVAILABLE, headers={'Retry-After': '1'})
 
-        # Sort by true chronology via reconstructed Gregorian start
-        docs.sort(key=lambda d: label_to_gregorian_date(mode, d['label_jalali']))
+            series = {}
+            for mode in modes:
+                rows = rollup_both(clip_daily(daily, mode, date_from, date_to), mode)
+                if limit:
+                    rows = rows[-limit:]
+                series[mode] = {t: [{'key': r['label_jalali'], 'value': r[t]} for r in rows] for t in types}
+            results.append({'merchantId': str(merchant_id) if merchant_id else None, 'series': series})
 
-        data = [{'key': d['label_jalali'], 'value': d.get(type, 0)} for d in docs]
-        return Response(data, status=200)
\ No newline at end of file
+        return Response({'results': results}, status=200)